@@ -0,0 +1,146 @@
+"""
+Compare bytes saved and CPU cost of each compression level.
+
+Compresses sample JSON (an API listing) and HTML (a page with a table) at
+every gzip level, and every brotli quality if the brotli package is
+installed, the way the app does. Stdlib only otherwise. Examples:
+
+    python bench/compression.py
+    # Real responses
+    curl -s http://localhost/home/login > page.html
+    python bench/compression.py --file page.html
+
+Pick COMPRESS_LEVEL where bytes saved stop growing much faster than the
+CPU time per MB.
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def sample_json(size):
+    """API listing of users, about size bytes."""
+    users = []
+    while len(json.dumps(users)) < size:
+        n = random.randint(1, 10 ** 6)
+        users.append({
+            'email': 'user{}@example{}.com'.format(n, n % 100),
+            'first_name': random.choice(['Ada', 'Alan', 'Grace', 'Linus']),
+            'last_name': random.choice(['Lovelace', 'Turing', 'Hopper']),
+            'company_name': 'Company {}'.format(n % 1000),
+            'is_premium': n % 10 == 0,
+            'confirmed': True,
+            'registered_on': '2026-{:02}-{:02}T10:00:00'.format(
+                n % 12 + 1, n % 28 + 1
+            ),
+        })
+    return json.dumps(users).encode('utf-8')
+
+
+def sample_html(size):
+    """Page with a table of users, about size bytes."""
+    rows = []
+    while sum(len(row) for row in rows) < size:
+        n = random.randint(1, 10 ** 6)
+        rows.append(
+            '<tr><td class="email">user{}@example.com</td>'
+            '<td class="company">Company {}</td>'
+            '<td><a href="/home/users/{}">Details</a></td></tr>\n'.format(
+                n, n % 1000, n
+            )
+        )
+    return (
+        '<!DOCTYPE html><html><head><title>Users</title></head><body>'
+        '<table>\n{}</table></body></html>'.format(''.join(rows))
+    ).encode('utf-8')
+
+
+def gzip(data, level):
+    """Compress like the app does."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def codecs():
+    """(encoding, level, compress function) to measure."""
+    for level in range(1, 10):
+        yield 'gzip', level, gzip
+    if brotli is not None:
+        for quality in range(0, 12):
+            yield 'br', quality, (
+                lambda data, quality: brotli.compress(data, quality=quality)
+            )
+
+
+def measure(data, compress, level, min_seconds):
+    """Compressed size and CPU seconds per compression."""
+    runs = 0
+    start = time.process_time()
+    while True:
+        compressed = compress(data, level)
+        runs += 1
+        elapsed = time.process_time() - start
+        if elapsed >= min_seconds:
+            return len(compressed), elapsed / runs
+
+
+def main():
+    """Print a table per sample."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument(
+        '--size',
+        type=int,
+        default=100000,
+        help='Bytes of the generated samples'
+    )
+    parser.add_argument(
+        '--file',
+        action='append',
+        default=[],
+        help='Measure this file too, can be repeated'
+    )
+    parser.add_argument(
+        '--seconds',
+        type=float,
+        default=0.2,
+        help='Minimum CPU time spent per level'
+    )
+    args = parser.parse_args()
+    random.seed(0)
+
+    samples = [
+        ('json', sample_json(args.size)),
+        ('html', sample_html(args.size)),
+    ]
+    for path in args.file:
+        with open(path, 'rb') as f:
+            samples.append((os.path.basename(path), f.read()))
+
+    for name, data in samples:
+        print("{}: {} bytes".format(name, len(data)))
+        print("{:>8} {:>5} {:>10} {:>8} {:>10}".format(
+            'encoding', 'level', 'bytes', 'saved', 'ms per MB'
+        ))
+        for encoding, level, compress in codecs():
+            size, seconds = measure(data, compress, level, args.seconds)
+            print("{:>8} {:>5} {:>10} {:>7.1f}% {:>10.1f}".format(
+                encoding,
+                level,
+                size,
+                100 - size * 100 / len(data),
+                seconds * 1000 * 2 ** 20 / len(data)
+            ))
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Measure API latency while the login form is flooded.
+
+Loads an API endpoint alone for --seconds, then again while --flood
+threads POST wrong credentials to the login form, and prints both
+summaries. Throttled logins are rejected with a 429 before any database
+query or password hashing, so API latency should barely move. Example:
+
+    python bench/login_flood.py http://localhost/api/usage/ \\
+        http://localhost/home/login --header "X-API-KEY: <token>"
+"""
+
+import argparse
+import threading
+import urllib.parse
+
+from throughput import parse_headers, report, run
+
+
+def main():
+    """Run the API load alone, then during a login flood."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('api_url')
+    parser.add_argument('login_url')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--flood', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument(
+        '--header',
+        action='append',
+        default=[],
+        help='"Name: value" of API requests, can be repeated'
+    )
+    args = parser.parse_args()
+    headers = parse_headers(args.header)
+
+    print("API alone")
+    report(*run(args.api_url, headers, args.concurrency, args.seconds))
+
+    data = urllib.parse.urlencode({
+        'email': 'victim@example.com',
+        'password': 'wrong password',
+    }).encode()
+    flood = {}
+    flooder = threading.Thread(target=lambda: flood.update(results=run(
+        args.login_url, {}, args.flood, args.seconds, data
+    )))
+    flooder.start()
+    api = run(args.api_url, headers, args.concurrency, args.seconds)
+    flooder.join()
+    print("\nAPI during login flood")
+    report(*api)
+    print("\nLogin flood")
+    report(*flood['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Measure /home/ page views per second of a logged in user.
+
+Logs in through the login form, then loads the playground page with the
+session cookie from concurrent threads, so that each view goes through
+session loading and the user cache. Stdlib only. Run it once per
+SESSION_STORE value to compare stores, e.g.:
+
+    flask create-user bench@example.com --password bench
+    python bench/page_views.py http://localhost bench@example.com bench
+"""
+
+import argparse
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from throughput import report, run
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Keep the redirect answering the login form, with its cookies."""
+
+    def redirect_request(self, *args, **kwargs):
+        """Do not follow."""
+        return None
+
+
+def login(base_url, email, password):
+    """Log in and return the Cookie header of the session."""
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(jar),
+        NoRedirect
+    )
+    data = urllib.parse.urlencode({
+        'email': email,
+        'password': password,
+    }).encode('ascii')
+    try:
+        opener.open(base_url + '/home/login', data)
+    except urllib.error.HTTPError as e:
+        location = e.headers.get('Location', '')
+        if e.code != 302 or location.endswith('/home/login'):
+            raise SystemExit("Login failed ({}).".format(e.code))
+    return '; '.join('{}={}'.format(c.name, c.value) for c in jar)
+
+
+def main():
+    """Log in, load the page and print a summary."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('base_url', help='e.g. http://localhost')
+    parser.add_argument('email')
+    parser.add_argument('password')
+    parser.add_argument('--page', default='/home/')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=30)
+    args = parser.parse_args()
+    base_url = args.base_url.rstrip('/')
+
+    cookie = login(base_url, args.email, args.password)
+    report(*run(
+        base_url + args.page,
+        {'Cookie': cookie},
+        args.concurrency,
+        args.seconds
+    ))
+
+
+if __name__ == '__main__':
+    main()
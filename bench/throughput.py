@@ -0,0 +1,123 @@
+"""
+Measure requests per second and latency of a running instance.
+
+Stdlib only, so it runs anywhere. Examples:
+
+    # Single container
+    python bench/throughput.py http://localhost/home/login
+
+    # Multi-node: compare throughput with 1, 2 and 3 nodes. The load
+    # balancer picks up rescaled nodes within 5 seconds
+    docker-compose -f docker-compose.multinode.yml up -d --build --scale app=1
+    docker-compose -f docker-compose.multinode.yml run --rm migrate \\
+        flask create-user bench@example.com --premium  # Prints <token>
+    python bench/throughput.py http://localhost:8080/api/usage/ \\
+        --header "X-API-KEY: <token>"
+    docker-compose -f docker-compose.multinode.yml up -d --scale app=3
+    python bench/throughput.py http://localhost:8080/api/usage/ \\
+        --header "X-API-KEY: <token>"
+"""
+
+import argparse
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+def worker(url, headers, deadline, results, lock, data=None):
+    """Send requests one after another until deadline, POSTs if data."""
+    latencies = []
+    statuses = {}
+    while time.time() < deadline:
+        request = urllib.request.Request(url, data=data, headers=headers)
+        start = time.time()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except OSError:
+            status = 'error'
+        latencies.append(time.time() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+    with lock:
+        results['latencies'] += latencies
+        for status, count in statuses.items():
+            results['statuses'][status] = (
+                results['statuses'].get(status, 0) + count
+            )
+
+
+def percentile(values, p):
+    """p-th percentile of sorted values."""
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run(url, headers, concurrency, seconds, data=None):
+    """Send requests from concurrency threads, return results and time."""
+    results = {'latencies': [], 'statuses': {}}
+    lock = threading.Lock()
+    deadline = time.time() + seconds
+    threads = [
+        threading.Thread(
+            target=worker,
+            args=(url, headers, deadline, results, lock, data)
+        )
+        for _ in range(concurrency)
+    ]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.time() - start
+
+
+def report(results, elapsed):
+    """Print throughput, latencies and statuses."""
+    latencies = sorted(results['latencies'])
+    print("{} requests in {:.1f}s: {:.1f} req/s".format(
+        len(latencies), elapsed, len(latencies) / elapsed
+    ))
+    print("latency p50 {:.1f}ms, p95 {:.1f}ms, p99 {:.1f}ms".format(
+        percentile(latencies, 50) * 1000,
+        percentile(latencies, 95) * 1000,
+        percentile(latencies, 99) * 1000,
+    ))
+    print("statuses: {}".format(results['statuses']))
+
+
+def parse_headers(values):
+    """Headers of "Name: value" strings."""
+    return dict(
+        [part.strip() for part in h.split(':', 1)] for h in values
+    )
+
+
+def main():
+    """Run the benchmark and print a summary."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('url')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument(
+        '--header',
+        action='append',
+        default=[],
+        help='"Name: value", can be repeated'
+    )
+    args = parser.parse_args()
+    report(*run(
+        args.url,
+        parse_headers(args.header),
+        args.concurrency,
+        args.seconds
+    ))
+
+
+if __name__ == '__main__':
+    main()
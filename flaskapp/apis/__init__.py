@@ -5,6 +5,9 @@ from flask_restplus import Api
 
 from .ns1 import api as ns1
 from .ns2 import api as ns2
+from .ns3 import api as ns3
+from .ns4 import api as ns4
+from .ns5 import api as ns5
 from .auth import authorizations
 
 blueprint = Blueprint('api', __name__)
@@ -18,3 +21,6 @@ api = Api(
 
 api.add_namespace(ns1, path='/build')
 api.add_namespace(ns2, path='/deploy')
+api.add_namespace(ns3, path='/admin')
+api.add_namespace(ns4, path='/usage')
+api.add_namespace(ns5, path='/datasets')
@@ -1,9 +1,10 @@
 """Authentication utilities needed by API."""
 
-from flask import request
+from flask import g, request
 from functools import wraps
 
 from setup import app
+from tracing import tracer
 from user_account.models import User
 
 # Auth dict needed by Swagger
@@ -16,6 +17,20 @@ authorizations = {
 }
 
 
+def get_api_user():
+    """
+    Get user authenticated by the token of the X-API-KEY header.
+
+    Token is verified once per request, then user is kept in g so that
+    decorators and endpoints do not query the db again.
+    """
+    if 'api_user' not in g:
+        token = request.headers.get("X-API-KEY")
+        with tracer.span('auth.verify_token'):
+            g.api_user = User.verify_auth_token(token) if token else None
+    return g.api_user
+
+
 def token_required(f):
     """
     Perform token based authentication.
@@ -38,11 +53,14 @@ def token_required(f):
 
         app.logger.debug("Got auth token: {}.".format(token))
         # Get user from JWT token and check if exists
-        user = User.verify_auth_token(token)
+        user = get_api_user()
         if not user:
             app.logger.debug("User not found for this token: {}".format(token))
             return {"message": "User not found."}, 401
 
+        # Used by usage metering
+        g.usage_user_id = user.id
+
         return f(*args, **kwargs)
 
     return decorated
@@ -52,19 +70,38 @@ def premium_required(f):
     """
     Check if user is premium.
 
-    We know that user exists thanks to the token_required decorator.
+    User is looked up once per request and shared with token_required.
     """
     @wraps(f)
     def decorated(*args, **kwargs):
         """Use this decorator on API endpoints restricted to premium users."""
-        token = None
-
         # Get user and check if is premium
-        token = request.headers["X-API-KEY"]
-        user = User.verify_auth_token(token)
+        user = get_api_user()
+        if not user:
+            return {"message": "User not found."}, 401
         if not user.is_premium:
             return {"message": "Restricted to premium users."}, 402
 
         return f(*args, **kwargs)
 
     return decorated
+
+
+def admin_required(f):
+    """
+    Check if user is an admin.
+
+    Must be used on top of the token_required decorator.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        """Use this decorator on API endpoints restricted to admins."""
+        user = get_api_user()
+        if not user:
+            return {"message": "User not found."}, 401
+        if not user.is_admin:
+            return {"message": "Restricted to admins."}, 403
+
+        return f(*args, **kwargs)
+
+    return decorated
@@ -0,0 +1,188 @@
+"""
+Idempotent API requests.
+
+A client retrying a request after a timeout cannot tell whether the first
+attempt landed. If it sends an Idempotency-Key header, the first
+successful response is kept per user, endpoint and key for
+IDEMPOTENCY_TTL seconds:
+- retries get the stored response back, without the body being read or
+written again
+- a duplicate sent while the first attempt is still running gets a 409
+right away, with a Retry-After header of IDEMPOTENCY_RETRY_AFTER seconds.
+Retried later, it gets the stored response, or runs itself if the first
+attempt failed or its lock expired (IDEMPOTENCY_LOCK_TTL)
+- reusing a key for a different request (other Content-Length or file
+name) gets a 422
+
+File names are only looked for in the first bytes of the body, so that a
+retry does not read the whole upload.
+
+State lives in the session store if any (so it is shared by workers and
+nodes), or in memory otherwise.
+"""
+
+from functools import wraps
+import json
+import re
+
+from flask import request
+
+from sessions import MemoryStore
+from .auth import get_api_user
+
+HEADER = 'Idempotency-Key'
+
+# Bytes of a multipart body read to find the name of its first file
+PEEK_SIZE = 8192
+FILENAME = re.compile(rb'filename="([^"]*)"')
+
+
+class Idempotency(object):
+    """Stored responses and in-flight locks of idempotency keys."""
+
+    def __init__(self):
+        """Store is set by init_app."""
+        self.store = MemoryStore()
+        self.config = {}
+        self.logger = None
+
+    def init_app(self, app, store=None):
+        """Use the session store if any, so that all workers share it."""
+        if store is not None:
+            self.store = store
+        self.config = app.config
+        self.logger = app.logger
+
+    def acquire(self, key):
+        """Tell if no other attempt with key is in flight, and lock it."""
+        return self.store.add(
+            'idempotency-lock:{}'.format(key),
+            1,
+            self.config['IDEMPOTENCY_LOCK_TTL']
+        )
+
+    def release(self, key):
+        """Let the next attempt with key run."""
+        self.store.delete('idempotency-lock:{}'.format(key))
+
+    def load(self, key):
+        """Return stored response of key, None if none."""
+        value = self.store.get('idempotency:{}'.format(key))
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def save(self, key, data, status, fingerprint):
+        """Store response of key for IDEMPOTENCY_TTL seconds."""
+        self.store.set(
+            'idempotency:{}'.format(key),
+            json.dumps({
+                'data': data,
+                'status': status,
+                'fingerprint': fingerprint,
+            }),
+            self.config['IDEMPOTENCY_TTL']
+        )
+
+
+idempotency = Idempotency()
+
+
+def body_length(parts):
+    """
+    Content-Length of current request, multipart boundaries excluded.
+
+    Clients draw a new boundary for each request, not always of the same
+    length. A multipart body of n parts holds n + 1 boundaries.
+    """
+    boundary = request.mimetype_params.get('boundary', '')
+    return (request.content_length or 0) - (parts + 1) * len(boundary)
+
+
+def fingerprint():
+    """Identify the request a key was first used for, after it ran."""
+    parts = len(request.form) + len(request.files)
+    return {
+        'parts': parts,
+        'length': body_length(parts),
+        'filenames': [f.filename for f in request.files.values()],
+    }
+
+
+def matches(fingerprint):
+    """
+    Tell if current request looks like the one of fingerprint.
+
+    Only the first bytes of the body are read, to find a file name.
+    """
+    if body_length(fingerprint['parts']) != fingerprint['length']:
+        return False
+    match = FILENAME.search(request.stream.read(PEEK_SIZE))
+    if match is None or not fingerprint['filenames']:
+        return True
+    return match.group(1).decode('utf-8', 'replace') in (
+        fingerprint['filenames']
+    )
+
+
+def replay(response):
+    """Build a flask_restplus response from a stored one."""
+    if not matches(response['fingerprint']):
+        return {
+            "message": "{} already used for a different request.".format(
+                HEADER
+            )
+        }, 422
+    return response['data'], response['status'], {
+        'Idempotent-Replayed': 'true'
+    }
+
+
+def idempotent(f):
+    """
+    Honor the Idempotency-Key header.
+
+    Must be used below the token_required decorator, and above anything
+    that reads the request body.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        """Replay stored response, or run endpoint and store its response."""
+        header = request.headers.get(HEADER)
+        if header is None:
+            return f(*args, **kwargs)
+        if not header or len(header) > 255:
+            return {"message": "Invalid {} header.".format(HEADER)}, 400
+
+        key = '{}:{}:{}'.format(get_api_user().id, request.endpoint, header)
+        response = idempotency.load(key)
+        if response is not None:
+            return replay(response)
+        if not idempotency.acquire(key):
+            # Do not hold the worker while the attempt in flight runs: the
+            # client retries later, and gets its response or takes over
+            retry_after = idempotency.config['IDEMPOTENCY_RETRY_AFTER']
+            return {
+                "message": "A request with this {} is in progress.".format(
+                    HEADER
+                )
+            }, 409, {'Retry-After': str(retry_after)}
+        # Attempt in flight may have finished in between
+        response = idempotency.load(key)
+        if response is not None:
+            idempotency.release(key)
+            return replay(response)
+
+        try:
+            result = f(*args, **kwargs)
+            data, status = result, 200
+            if isinstance(result, tuple):
+                data, status = result[0], result[1]
+            # Only successes are final, failed attempts can be retried
+            if status < 300:
+                idempotency.save(key, data, status, fingerprint())
+            return result
+        finally:
+            idempotency.release(key)
+
+    return decorated
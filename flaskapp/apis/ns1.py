@@ -1,12 +1,15 @@
 """Upload raw data file."""
 
-from flask import request
 from flask_restplus import Namespace, Resource
 from werkzeug.datastructures import FileStorage
 
 from setup import app
-from .auth import token_required, premium_required
-from user_account.models import User
+from datasets import DatasetBusy, datasets
+from health import long_request
+from tracing import tracer
+from .auth import get_api_user, token_required, premium_required
+from .idempotency import idempotent
+from query_budget import query_budget
 
 api = Namespace('Build', description='Description')
 
@@ -18,6 +21,11 @@ parser1.add_argument(
     location='files',
     help='Data file'
 )
+parser1.add_argument(
+    'Idempotency-Key',
+    location='headers',
+    help='Retries with the same key get the first response back'
+)
 
 
 @api.route('/1_upload')
@@ -25,26 +33,31 @@ class Upload(Resource):
     """Upload the raw data file."""
 
     @api.doc(security='apikey')
+    @long_request
     @premium_required
     @token_required
+    @idempotent
     @api.expect(parser1)
+    @query_budget(1)
     def post(self):
         """Post data."""
         # Get user from JWT token.
         # We know that token and user exist because already checked in
-        # decorator.
-        token = request.headers["X-API-KEY"]
-        user = User.verify_auth_token(token)
+        # decorator, so no new db query here.
+        user = get_api_user()
         app.logger.debug("API user is {}".format(user))
 
-        # Save file to user folder
-        args = parser1.parse_args()
+        # Save file as a new version of the user dataset
+        with tracer.span('upload.parse_multipart'):
+            args = parser1.parse_args()
         uploaded_file = args['file']
         fname = uploaded_file.filename
-        uploaded_file.save('{}/{}/data/data0.csv'.format(
-            app.config['USER_FOLDERS_PATH'],
-            user.email)
-        )
+        with tracer.span('storage.save', filename=fname):
+            try:
+                entry = datasets.add(user, 'build', uploaded_file.stream)
+            except DatasetBusy:
+                return {"message": "Another upload is in progress."}, 409
         return {
-            "Status": "Your file===" + fname + "===was Successfully Uploaded"
+            "Status": "Your file===" + fname + "===was Successfully Uploaded",
+            "Version": entry
         }
@@ -0,0 +1,392 @@
+"""Administrate users in bulk."""
+
+import csv
+from datetime import datetime
+import io
+import time
+
+from flask import Response, stream_with_context
+from flask_restplus import Namespace, Resource, fields
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+
+from health import long_request
+from mail_queue import mail_queue
+from profiling import profiler
+from setup import app, db
+from .auth import token_required, admin_required
+from user_account.models import User, invalidate_user_cache
+from user_account.throttle import throttle
+from user_account.views import create_user_folders, send_pwd_reset_email
+
+api = Namespace('Admin', description='User administration')
+
+# Lengths of the flask_user columns
+EMAIL_FIELD = fields.String(
+    required=True,
+    max_length=120,
+    pattern=r'^[^@\s]+@[^@\s]+\.[^@\s]+$'
+)
+
+new_user = api.model('NewUser', {
+    'email': EMAIL_FIELD,
+    'first_name': fields.String(max_length=50),
+    'last_name': fields.String(max_length=50),
+    'company_name': fields.String(max_length=50),
+    'is_premium': fields.Boolean(default=False),
+})
+
+new_users = api.model('NewUsers', {
+    'users': fields.List(fields.Nested(new_user), required=True),
+})
+
+emails = api.model('Emails', {
+    'emails': fields.List(EMAIL_FIELD, required=True),
+})
+
+user = api.model('User', {
+    'email': fields.String,
+    'first_name': fields.String,
+    'last_name': fields.String,
+    'company_name': fields.String,
+    'is_premium': fields.Boolean,
+    'confirmed': fields.Boolean,
+    'registered_on': fields.DateTime,
+})
+
+user_page = api.model('UserPage', {
+    'users': fields.List(fields.Nested(user)),
+    'next': fields.String(description='Pass as "after" to get next page'),
+})
+
+list_parser = api.parser()
+list_parser.add_argument('after', location='args', help='Last email seen')
+list_parser.add_argument('limit', type=int, default=100, location='args')
+list_parser.add_argument('q', location='args', help='Email prefix')
+list_parser.add_argument('is_premium', type=int, location='args')
+list_parser.add_argument('confirmed', type=int, location='args')
+
+# Password of users created in bulk, no password hash matches it
+NO_PASSWORD = '!'
+
+# Columns exported to CSV
+EXPORT_COLUMNS = [
+    'email',
+    'first_name',
+    'last_name',
+    'company_name',
+    'sector',
+    'country',
+    'is_premium',
+    'confirmed',
+    'registered_on',
+]
+
+
+def chunks(items, size):
+    """Split a list in chunks of size items."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def set_premium(user_emails, is_premium):
+    """
+    Set is_premium on many users with set based updates.
+
+    Small lists are updated with UPDATE ... WHERE lower(email) IN (...) in
+    batches. Big lists are COPYed to a temporary table and updated with a
+    single UPDATE ... FROM join.
+    Return the ids of updated users.
+    """
+    user_emails = [email.lower() for email in user_emails]
+    if len(user_emails) <= app.config['ADMIN_COPY_THRESHOLD']:
+        updated = []
+        for batch in chunks(user_emails, app.config['ADMIN_BATCH_SIZE']):
+            statement = User.__table__.update().where(
+                db.func.lower(User.email).in_(batch)
+            ).values(is_premium=is_premium).returning(User.id)
+            updated += [row[0] for row in db.session.execute(statement)]
+        return updated
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for email in user_emails:
+        writer.writerow([email])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute(
+        "CREATE TEMP TABLE tmp_admin_emails (email VARCHAR(120)) "
+        "ON COMMIT DROP"
+    )
+    cursor.copy_expert(
+        "COPY tmp_admin_emails (email) FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
+    result = db.session.execute(
+        text(
+            "UPDATE flask_user SET is_premium = :is_premium, "
+            "updated_on = now() "
+            "FROM tmp_admin_emails "
+            "WHERE lower(flask_user.email) = tmp_admin_emails.email "
+            "RETURNING flask_user.id"
+        ),
+        {'is_premium': is_premium}
+    )
+    return [row[0] for row in result]
+
+
+@api.route('/users')
+class Users(Resource):
+    """List and create users."""
+
+    @api.doc(security='apikey')
+    @admin_required
+    @token_required
+    @api.expect(list_parser)
+    @api.marshal_with(user_page)
+    def get(self):
+        """
+        List users, ordered by email.
+
+        Keyset pagination: pass the "next" value of a page as "after" in
+        order to get the following page. Cost does not grow with the page
+        number, unlike OFFSET.
+        """
+        args = list_parser.parse_args()
+        limit = max(1, min(args['limit'], app.config['ADMIN_MAX_PAGE_SIZE']))
+        # Collation of the email indexes, see User
+        email = User.email.collate('C')
+        query = User.query
+        if args['is_premium'] is not None:
+            query = query.filter(User.is_premium == bool(args['is_premium']))
+        if args['confirmed'] is not None:
+            query = query.filter(User.confirmed == bool(args['confirmed']))
+        if args['q']:
+            prefix = args['q'].replace('\\', '\\\\').replace('%', '\\%')
+            prefix = prefix.replace('_', '\\_')
+            query = query.filter(email.like(prefix + '%'))
+        if args['after']:
+            query = query.filter(email > args['after'])
+        users = query.order_by(email).limit(limit).all()
+        next_email = users[-1].email if len(users) == limit else None
+        return {'users': users, 'next': next_email}
+
+    @api.doc(security='apikey')
+    @long_request
+    @admin_required
+    @token_required
+    @api.expect(new_users, validate=True)
+    def post(self):
+        """
+        Create users in bulk.
+
+        Users are created confirmed, with their folders, and without a
+        password (hashing thousands of them would hold the worker for
+        minutes): each one gets a password reset link by email instead.
+        Already existing emails (case insensitively) are skipped.
+        Users are committed first: users whose folders or email failed are
+        listed in "failed", they can ask for a password reset later.
+        """
+        now = datetime.now()
+        rows = [
+            {
+                'email': u['email'],
+                'password': NO_PASSWORD,
+                'first_name': u.get('first_name'),
+                'last_name': u.get('last_name'),
+                'company_name': u.get('company_name'),
+                'is_premium': bool(u.get('is_premium', False)),
+                'is_admin': False,
+                'registered_on': now,
+                'confirmed': True,
+            }
+            for u in api.payload['users']
+        ]
+        created = []
+        for batch in chunks(rows, app.config['ADMIN_BATCH_SIZE']):
+            statement = insert(User.__table__).values(batch)
+            statement = statement.on_conflict_do_nothing().returning(
+                User.id,
+                User.email
+            )
+            created += db.session.execute(statement).fetchall()
+        db.session.commit()
+        failed = []
+        for user_id, email in created:
+            throttle.forget_unknown(email)
+            try:
+                create_user_folders(User(id=user_id, email=email))
+                send_pwd_reset_email(email)
+            except Exception:
+                app.logger.exception(
+                    "Could not set up user {} created in bulk.".format(email)
+                )
+                failed.append(email)
+        app.logger.debug("{} users created in bulk.".format(len(created)))
+        return {
+            'created': [email for _, email in created],
+            'skipped': len(rows) - len(created),
+            'failed': failed,
+        }, 201
+
+
+class PremiumUpdate(Resource):
+    """Base resource for premium upgrades and downgrades."""
+
+    is_premium = None
+
+    @api.doc(security='apikey')
+    @long_request
+    @admin_required
+    @token_required
+    @api.expect(emails, validate=True)
+    def post(self):
+        """Update premium status of users."""
+        user_emails = list(set(api.payload['emails']))
+        updated = set_premium(user_emails, self.is_premium)
+        db.session.commit()
+        invalidate_user_cache(updated)
+        app.logger.debug("Premium set to {} for {} users.".format(
+            self.is_premium, len(updated))
+        )
+        return {'updated': len(updated)}
+
+
+@api.route('/users/upgrade')
+class Upgrade(PremiumUpdate):
+    """Upgrade users to premium."""
+
+    is_premium = True
+
+
+@api.route('/users/downgrade')
+class Downgrade(PremiumUpdate):
+    """Downgrade premium users."""
+
+    is_premium = False
+
+
+@api.route('/users/export')
+class Export(Resource):
+    """Export users as CSV."""
+
+    @api.doc(security='apikey')
+    @long_request
+    @admin_required
+    @token_required
+    def get(self):
+        """
+        Stream all users as CSV.
+
+        Rows are fetched by batches so the whole table is never loaded
+        in memory.
+        """
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+            # Collation of the email indexes, see User
+            query = User.query.order_by(User.email.collate('C')).yield_per(
+                app.config['ADMIN_BATCH_SIZE']
+            )
+            for i, u in enumerate(query, 1):
+                writer.writerow([getattr(u, c) for c in EXPORT_COLUMNS])
+                if i % app.config['ADMIN_BATCH_SIZE'] == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename=users.csv'}
+        )
+
+
+@api.route('/throttle')
+class Throttling(Resource):
+    """Rejections of login, registration and password reset forms."""
+
+    @api.doc(security='apikey')
+    @admin_required
+    @token_required
+    def get(self):
+        """
+        Count rejections by reason (ip, email, backoff), reset daily.
+
+        Without a SESSION_STORE, counts only cover the worker answering
+        ("shared" is false).
+        """
+        return throttle.rejections()
+
+
+profile_request = api.model('ProfileRequest', {
+    'seconds': fields.Float(default=10, description='Sampling duration'),
+})
+
+
+@api.route('/profile')
+class Profile(Resource):
+    """Profile the worker serving this request."""
+
+    @api.doc(security='apikey')
+    @admin_required
+    @token_required
+    @api.expect(profile_request)
+    def post(self):
+        """
+        Sample all threads of this worker for some seconds.
+
+        Sampling runs in background, the worker keeps serving requests.
+        Get the result with the returned profile id once done.
+        """
+        if not profiler.enabled:
+            api.abort(404, "Profiling is disabled.")
+        seconds = (api.payload or {}).get('seconds', 10)
+        if (isinstance(seconds, bool) or
+                not isinstance(seconds, (int, float)) or seconds <= 0):
+            api.abort(400, "seconds must be a positive number.")
+        profile_id = profiler.profile_worker(seconds)
+        if profile_id is None:
+            api.abort(409, "A profile is already running on this worker.")
+        return {'id': profile_id}, 202
+
+
+@api.route('/profile/<profile_id>')
+class ProfileResult(Resource):
+    """Result of a worker or request profile."""
+
+    @api.doc(security='apikey')
+    @admin_required
+    @token_required
+    def get(self, profile_id):
+        """
+        Get collapsed stacks (and SQL queries of a request profile).
+
+        Answer 202 while a worker profile is still sampling.
+        """
+        if not profiler.enabled:
+            api.abort(404, "Profiling is disabled.")
+        profile = profiler.load(profile_id)
+        if profile is None:
+            api.abort(404, "Profile not found.")
+        if profile.get('status') == 'running':
+            retry_after = max(1, int(profile['ends_at'] - time.time()) + 1)
+            return profile, 202, {'Retry-After': str(retry_after)}
+        return profile
+
+
+@api.route('/jobs/<job_id>')
+class Job(Resource):
+    """Status of a background job, e.g. a queued email."""
+
+    @api.doc(security='apikey')
+    @admin_required
+    @token_required
+    def get(self, job_id):
+        """Get status: queued, sent or failed."""
+        status = mail_queue.status(job_id)
+        if status is None:
+            api.abort(404, "Job not found or expired.")
+        return {'id': job_id, 'status': status}
@@ -0,0 +1,75 @@
+"""Query API usage."""
+
+from flask_restplus import Namespace, Resource, fields, inputs
+
+from setup import db
+from .auth import get_api_user, token_required
+from .usage import ApiUsage
+from query_budget import query_budget
+
+api = Namespace('Usage', description='API usage')
+
+usage = api.model('Usage', {
+    'endpoint': fields.String,
+    'calls': fields.Integer,
+    'bytes_in': fields.Integer,
+    'bytes_out': fields.Integer,
+})
+
+parser1 = api.parser()
+parser1.add_argument(
+    'since',
+    type=inputs.datetime_from_iso8601,
+    location='args',
+    help='Only count usage from this UTC date'
+)
+parser1.add_argument(
+    'until',
+    type=inputs.datetime_from_iso8601,
+    location='args',
+    help='Only count usage before this UTC date'
+)
+parser1.add_argument(
+    'user_id',
+    type=int,
+    location='args',
+    help='Admins only: usage of another user'
+)
+
+
+@api.route('/')
+class Usage(Resource):
+    """Usage aggregates of a user."""
+
+    @api.doc(security='apikey')
+    @token_required
+    @api.expect(parser1)
+    @api.marshal_list_with(usage)
+    @query_budget(2)
+    def get(self):
+        """
+        Get calls and bytes per endpoint.
+
+        Usage is written to database periodically by each worker, so the
+        last minutes may not be counted yet.
+        """
+        user = get_api_user()
+
+        args = parser1.parse_args()
+        user_id = user.id
+        if args['user_id'] is not None and args['user_id'] != user.id:
+            if not user.is_admin:
+                api.abort(403, "Restricted to admins.")
+            user_id = args['user_id']
+
+        query = db.session.query(
+            ApiUsage.endpoint,
+            db.func.sum(ApiUsage.calls).label('calls'),
+            db.func.sum(ApiUsage.bytes_in).label('bytes_in'),
+            db.func.sum(ApiUsage.bytes_out).label('bytes_out'),
+        ).filter(ApiUsage.user_id == user_id)
+        if args['since']:
+            query = query.filter(ApiUsage.period_start >= args['since'])
+        if args['until']:
+            query = query.filter(ApiUsage.period_start < args['until'])
+        return query.group_by(ApiUsage.endpoint).all()
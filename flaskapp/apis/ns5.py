@@ -0,0 +1,112 @@
+"""List and fetch versions of uploaded datasets."""
+
+from flask import Response, request, stream_with_context
+from flask_restplus import Namespace, Resource, fields
+from werkzeug.datastructures import ContentRange
+
+from datasets import NAMES, datasets
+from health import long_request
+from .auth import get_api_user, token_required
+from query_budget import query_budget
+
+api = Namespace('Datasets', description='Versions of uploaded datasets')
+
+version = api.model('DatasetVersion', {
+    'version': fields.Integer,
+    'size': fields.Integer(description='Bytes'),
+    'sha256': fields.String,
+    'rows': fields.Integer(description='Lines, header included'),
+    'created_at': fields.String(description='UTC date, ISO 8601'),
+})
+
+
+@api.route('/<string:name>')
+@api.doc(params={'name': 'Dataset: build or deploy'})
+class Versions(Resource):
+    """Versions of a dataset."""
+
+    @api.doc(security='apikey')
+    @token_required
+    @api.marshal_list_with(version)
+    @query_budget(1)
+    def get(self, name):
+        """Get manifest of kept versions, oldest first."""
+        if name not in NAMES:
+            api.abort(404, "Unknown dataset.")
+        return datasets.versions(get_api_user(), name)
+
+
+@api.route('/<string:name>/<int:number>')
+@api.doc(params={'name': 'Dataset: build or deploy'})
+class Version(Resource):
+    """File of a dataset version."""
+
+    @api.doc(security='apikey')
+    @long_request
+    @token_required
+    @query_budget(1)
+    def get(self, name, number):
+        """
+        Download a version.
+
+        Supports a single byte range (Range header), so that a part of a
+        version can be read without downloading the whole file.
+        """
+        if name not in NAMES:
+            api.abort(404, "Unknown dataset.")
+        user = get_api_user()
+        entry = datasets.get(user, name, number)
+        if entry is None:
+            api.abort(404, "Unknown or dropped version.")
+
+        # Versions never change, their hash is a strong ETag. If-None-Match
+        # uses the weak comparison
+        if request.if_none_match.contains_weak(entry['sha256']):
+            return Response(status=304)
+
+        size = entry['size']
+        start, stop = 0, size
+        status = 200
+        if request.range is not None:
+            byte_range = request.range.range_for_length(size)
+            if byte_range is None:
+                response = Response(status=416)
+                response.headers['Content-Range'] = 'bytes */{}'.format(size)
+                return response
+            start, stop = byte_range
+            status = 206
+
+        try:
+            f = datasets.open(user, name, number, start)
+        except FileNotFoundError:
+            api.abort(404, "Unknown or dropped version.")
+
+        def generate():
+            remaining = stop - start
+            try:
+                while remaining > 0:
+                    chunk = f.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+            finally:
+                f.close()
+
+        filename = '{}-v{}.csv'.format(name, number)
+        response = Response(
+            stream_with_context(generate()),
+            status=status,
+            mimetype='text/csv',
+            headers={
+                'Accept-Ranges': 'bytes',
+                'Content-Length': str(stop - start),
+                'Content-Disposition': 'attachment; filename=' + filename,
+            }
+        )
+        response.set_etag(entry['sha256'])
+        if status == 206:
+            response.headers['Content-Range'] = ContentRange(
+                'bytes', start, stop, size
+            ).to_header()
+        return response
@@ -0,0 +1,122 @@
+"""
+Precomputed Swagger spec.
+
+Flask-RESTPlus rebuilds swagger.json from namespaces, parsers and models
+every time it is requested. Here the spec is generated once (at startup or
+at build time with `flask export-swagger`) and served as static bytes with
+pre-compressed variants. Each variant has its own strong ETag, since its
+bytes differ from the identity body.
+"""
+
+import hashlib
+import json
+import os
+
+import click
+from flask import request, Response
+
+from compression import available_encodings, compress, negotiate_encoding
+
+SPEC_FILE_NAME = 'swagger.json'
+
+
+class SpecCache(object):
+    """Serialized spec plus its compressed variants and their ETags."""
+
+    def __init__(self, body):
+        """Compress body once and compute ETags from it."""
+        self.body = body
+        digest = hashlib.sha256(body).hexdigest()
+        # Spec is compressed only once so use the highest levels
+        levels = {'gzip': 9, 'br': 11}
+        self.variants = {
+            encoding: compress(body, encoding, levels[encoding])
+            for encoding in available_encodings()
+        }
+        # Keyed by Content-Encoding, None for the identity body
+        self.etags = {None: digest}
+        for encoding in self.variants:
+            self.etags[encoding] = '{}-{}'.format(digest, encoding)
+
+    @classmethod
+    def from_api(cls, app, api):
+        """Generate spec from the restplus Api object."""
+        with app.test_request_context():
+            schema = api.__schema__
+        body = json.dumps(schema, sort_keys=True, separators=(',', ':'))
+        return cls(body.encode('utf-8'))
+
+    @classmethod
+    def from_folder(cls, folder):
+        """Load a spec previously exported to folder, None if missing."""
+        path = os.path.join(folder, SPEC_FILE_NAME)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return cls(f.read())
+
+    def export(self, folder):
+        """Write spec and its compressed variants to folder."""
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, SPEC_FILE_NAME)
+        with open(path, 'wb') as f:
+            f.write(self.body)
+        extensions = {'gzip': '.gz', 'br': '.br'}
+        for encoding, data in self.variants.items():
+            with open(path + extensions[encoding], 'wb') as f:
+                f.write(data)
+        return path
+
+    def make_response(self, max_age):
+        """Build a cacheable response, 304 if client already has it."""
+        encoding = negotiate_encoding(self.variants)
+        etag = self.etags[encoding]
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            if encoding:
+                response = Response(
+                    self.variants[encoding],
+                    mimetype='application/json'
+                )
+                response.headers['Content-Encoding'] = encoding
+            else:
+                response = Response(self.body, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'public, max-age={}'.format(
+            max_age
+        )
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+def init_spec_cache(app, api):
+    """
+    Replace restplus' swagger.json view by a precomputed one.
+
+    Must be called after the api blueprint has been registered, and before
+    workers start serving traffic (uwsgi forks after loading the app, so
+    the spec is built once in the master process).
+    """
+    folder = app.config['SWAGGER_SPEC_PATH']
+    spec = SpecCache.from_folder(folder) if folder else None
+    if spec is None:
+        spec = SpecCache.from_api(app, api)
+        app.logger.debug("Swagger spec generated at startup.")
+    else:
+        app.logger.debug("Swagger spec loaded from {}.".format(folder))
+
+    def serve_spec():
+        """Serve the precomputed swagger.json."""
+        return spec.make_response(app.config['SWAGGER_SPEC_MAX_AGE'])
+
+    app.view_functions[api.endpoint('specs')] = serve_spec
+
+    @app.cli.command('export-swagger')
+    def export_swagger():
+        """Write swagger.json and compressed variants at build time."""
+        export_folder = folder or '.'
+        path = SpecCache.from_api(app, api).export(export_folder)
+        click.echo("Swagger spec exported to {}.".format(path))
+
+    return spec
@@ -0,0 +1,322 @@
+"""
+Per user API usage metering.
+
+Calls and bytes are counted in memory inside each worker, then flushed
+periodically to the api_usage table with batched upserts, so recording
+never adds a database write to the request path.
+
+Flushing is at least once: counters that could not be written are merged
+back and retried on next flush, and a last flush happens when the worker
+shuts down. If that one keeps failing, counters are spilled to JSON files
+in USAGE_SPILL_PATH, picked up by the next flush of any worker.
+
+Bytes out of streamed responses (CSV exports, downloads, compressed
+streams) are counted as they are sent.
+"""
+
+from datetime import datetime
+import glob
+import json
+import os
+import threading
+import time
+
+from flask import g, request
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DataError, IntegrityError
+
+from setup import db, on_worker_exit
+
+
+class ApiUsage(db.Model):
+    """API usage of a user on an endpoint during a period."""
+
+    __tablename__ = "api_usage"
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('flask_user.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+    endpoint = db.Column(db.String(100), primary_key=True)
+    period_start = db.Column(db.DateTime, primary_key=True)
+    calls = db.Column(db.BigInteger, default=0, nullable=False)
+    bytes_in = db.Column(db.BigInteger, default=0, nullable=False)
+    bytes_out = db.Column(db.BigInteger, default=0, nullable=False)
+
+
+class UsageRecorder(object):
+    """In memory usage counters of a worker, flushed by a thread."""
+
+    def __init__(self, app):
+        """Counters are keyed by (user_id, endpoint, period_start)."""
+        self.app = app
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.pid = None
+
+    def record(self, user_id, endpoint, bytes_in, bytes_out):
+        """Count one call. Only touches memory."""
+        self.ensure_flusher()
+        period = self.app.config['USAGE_PERIOD']
+        period_start = datetime.utcfromtimestamp(
+            int(time.time()) // period * period
+        )
+        key = (user_id, endpoint, period_start)
+        with self.lock:
+            counter = self.counters.setdefault(key, [0, 0, 0])
+            counter[0] += 1
+            counter[1] += bytes_in
+            counter[2] += bytes_out
+
+    def ensure_flusher(self):
+        """
+        Start the flusher thread once per process.
+
+        Started lazily because uwsgi forks workers after loading the app
+        and threads do not survive a fork.
+        """
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            # Counters inherited from the master process belong to it
+            self.counters = {}
+        flusher = threading.Thread(target=self.run, name='usage-flusher')
+        flusher.daemon = True
+        flusher.start()
+
+    def run(self):
+        """Flush counters, and spilled ones, every USAGE_FLUSH_INTERVAL."""
+        while not self.stopped.wait(self.app.config['USAGE_FLUSH_INTERVAL']):
+            self.load_spilled()
+            self.flush()
+
+    def merge(self, counters):
+        """Add counters back, e.g. after a failed flush."""
+        with self.lock:
+            for key, (calls, bytes_in, bytes_out) in counters.items():
+                counter = self.counters.setdefault(key, [0, 0, 0])
+                counter[0] += calls
+                counter[1] += bytes_in
+                counter[2] += bytes_out
+
+    def write(self, counters):
+        """Upsert counters by batches, in one transaction."""
+        rows = [
+            {
+                'user_id': user_id,
+                'endpoint': endpoint,
+                'period_start': period_start,
+                'calls': calls,
+                'bytes_in': bytes_in,
+                'bytes_out': bytes_out,
+            }
+            for (user_id, endpoint, period_start), (calls, bytes_in, bytes_out)
+            in counters.items()
+        ]
+        batch_size = self.app.config['USAGE_FLUSH_BATCH_SIZE']
+        table = ApiUsage.__table__
+        for i in range(0, len(rows), batch_size):
+            statement = insert(table).values(rows[i:i + batch_size])
+            statement = statement.on_conflict_do_update(
+                index_elements=['user_id', 'endpoint', 'period_start'],
+                set_={
+                    'calls': table.c.calls + statement.excluded.calls,
+                    'bytes_in': (table.c.bytes_in +
+                                 statement.excluded.bytes_in),
+                    'bytes_out': (table.c.bytes_out +
+                                  statement.excluded.bytes_out),
+                }
+            )
+            db.session.execute(statement)
+        db.session.commit()
+
+    def rollback(self):
+        """Roll back, logging errors: the connection may be gone."""
+        try:
+            db.session.rollback()
+        except Exception:
+            self.app.logger.exception("Usage rollback failed.")
+
+    def flush(self):
+        """
+        Upsert current counters. Return rows written.
+
+        If the database rejects the batch (e.g. a deleted user), rows are
+        written one by one and the rejected ones are dropped, so that they
+        do not block every later flush. Other errors are retried on next
+        flush.
+        """
+        with self.lock:
+            counters, self.counters = self.counters, {}
+        if not counters:
+            return 0
+
+        pending = dict(counters)
+        dropped = 0
+        with self.app.app_context():
+            try:
+                try:
+                    self.write(pending)
+                    pending = {}
+                except (IntegrityError, DataError):
+                    self.rollback()
+                    self.app.logger.warning(
+                        "Usage batch rejected, writing rows one by one."
+                    )
+                    for key, counter in counters.items():
+                        try:
+                            self.write({key: counter})
+                        except (IntegrityError, DataError):
+                            self.rollback()
+                            self.app.logger.error(
+                                "Usage of {} dropped, it cannot be "
+                                "written.".format(key)
+                            )
+                            dropped += 1
+                        del pending[key]
+            except Exception:
+                self.rollback()
+                self.app.logger.exception(
+                    "Usage flush failed, will retry on next flush."
+                )
+                self.merge(pending)
+            finally:
+                try:
+                    db.session.remove()
+                except Exception:
+                    self.app.logger.exception("Usage session removal failed.")
+        return len(counters) - len(pending) - dropped
+
+    def spill(self):
+        """Write current counters to a file of USAGE_SPILL_PATH."""
+        with self.lock:
+            counters, self.counters = self.counters, {}
+        if not counters:
+            return
+        path = self.app.config['USAGE_SPILL_PATH']
+        os.makedirs(path, exist_ok=True)
+        name = os.path.join(path, 'usage-{}-{}.json'.format(
+            os.getpid(),
+            int(time.time() * 1000)
+        ))
+        with open(name + '.tmp', 'w') as f:
+            json.dump([
+                [user_id, endpoint, period_start.isoformat()] + counter
+                for (user_id, endpoint, period_start), counter
+                in counters.items()
+            ], f)
+        os.rename(name + '.tmp', name)
+        self.app.logger.error(
+            "Usage flush failed at shutdown, counters spilled to {}.".format(
+                name
+            )
+        )
+
+    def load_spilled(self):
+        """Merge counters spilled by stopped workers into ours."""
+        path = self.app.config['USAGE_SPILL_PATH']
+        for name in glob.glob(os.path.join(path, 'usage-*.json')):
+            # Renaming claims the file, other workers may be trying too
+            claimed = '{}.{}'.format(name, os.getpid())
+            try:
+                os.rename(name, claimed)
+            except OSError:
+                continue
+            with open(claimed) as f:
+                rows = json.load(f)
+            self.merge({
+                (user_id, endpoint, datetime.strptime(
+                    period_start, '%Y-%m-%dT%H:%M:%S'
+                )): counter
+                for user_id, endpoint, period_start, *counter in rows
+            })
+            os.remove(claimed)
+
+    def shutdown(self):
+        """
+        Stop flusher thread and flush what is left.
+
+        Flush is retried USAGE_SHUTDOWN_RETRIES times, then counters are
+        spilled to disk.
+        """
+        self.stopped.set()
+        if self.pid != os.getpid():
+            return
+        for attempt in range(self.app.config['USAGE_SHUTDOWN_RETRIES']):
+            if attempt:
+                time.sleep(2 ** (attempt - 1))
+            self.flush()
+            with self.lock:
+                if not self.counters:
+                    return
+        self.spill()
+
+
+class CountingBody(object):
+    """Response body counting the bytes it yields."""
+
+    def __init__(self, response):
+        """Wrap body of response."""
+        self.body = response.response
+        self.chunks = response.iter_encoded()
+        self.bytes = 0
+
+    def __iter__(self):
+        """Yield encoded chunks of the body."""
+        for chunk in self.chunks:
+            self.bytes += len(chunk)
+            yield chunk
+
+    def close(self):
+        """Close wrapped body, e.g. a file."""
+        if hasattr(self.body, 'close'):
+            self.body.close()
+
+
+def init_usage_metering(app):
+    """
+    Record usage of requests authenticated by token_required.
+
+    token_required stores the user id in g.usage_user_id.
+    """
+    recorder = UsageRecorder(app)
+
+    @app.after_request
+    def record_usage(response):
+        """
+        Count call and bytes of authenticated API requests.
+
+        Streamed responses have no length yet, they are counted once sent.
+        """
+        user_id = g.get('usage_user_id')
+        if user_id is None:
+            return response
+        endpoint = request.endpoint
+        bytes_in = request.content_length or 0
+        if response.content_length is not None:
+            recorder.record(
+                user_id,
+                endpoint,
+                bytes_in,
+                response.content_length
+            )
+            return response
+
+        body = CountingBody(response)
+        response.response = body
+        response.call_on_close(lambda: recorder.record(
+            user_id,
+            endpoint,
+            bytes_in,
+            body.bytes
+        ))
+        return response
+
+    on_worker_exit(recorder.shutdown)
+
+    return recorder
@@ -0,0 +1,177 @@
+"""
+Response compression and conditional requests.
+
+Hooked on the whole app so both the api and user_account_pages blueprints
+benefit from it:
+- GET responses get an ETag and a 304 if client sent a matching
+If-None-Match
+- bodies are compressed with brotli (if installed) or gzip depending on
+Accept-Encoding, size and mimetype
+- streamed responses are compressed chunk by chunk
+- responses accepting byte ranges (Accept-Ranges) are never compressed, a
+resumed download would mix compressed and identity bytes
+- compressed versions of cacheable (static) responses are kept in memory
+"""
+
+from collections import OrderedDict
+import threading
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def available_encodings():
+    """Encodings this process is able to produce, best first."""
+    if brotli is not None:
+        return ('br', 'gzip')
+    return ('gzip',)
+
+
+def negotiate_encoding(available):
+    """Pick the best encoding accepted by client, None for identity."""
+    best, best_quality = None, 0
+    for encoding in ('br', 'gzip'):
+        quality = request.accept_encodings[encoding]
+        if encoding in available and quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data, encoding, level):
+    """Compress a whole body at once."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding, level):
+    """
+    Compress an iterable of chunks lazily.
+
+    Each chunk is flushed so that streamed data keeps reaching client
+    as it is produced instead of being held in the compressor.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+class CompressedCache(object):
+    """Small thread safe LRU of compressed bodies keyed by ETag."""
+
+    def __init__(self, size):
+        """Keep at most size entries."""
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return cached body or None."""
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+            return data
+
+    def set(self, key, data):
+        """Store body and evict the least recently used entry if needed."""
+        with self.lock:
+            self.entries[key] = data
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+def init_compression(app):
+    """Register the compression and conditional request hook on app."""
+    cache = CompressedCache(app.config['COMPRESS_CACHE_SIZE'])
+
+    def compressible(response):
+        """Tell if response may be compressed, depending on the client."""
+        return (
+            app.config['COMPRESS_ENABLED'] and
+            response.mimetype in app.config['COMPRESS_MIMETYPES'] and
+            'Content-Encoding' not in response.headers and
+            # make_conditional sets it to "none" on other responses
+            response.headers.get('Accept-Ranges', 'none') == 'none'
+        )
+
+    @app.after_request
+    def compress_response(response):
+        """Handle If-None-Match then compress response if worth it."""
+        if request.method not in ('GET', 'HEAD'):
+            return response
+        if response.status_code != 200:
+            return response
+
+        # Whether this response is compressed depends on Accept-Encoding,
+        # caches must know even when it is not (small body, client without
+        # gzip) and on 304s
+        if compressible(response):
+            response.vary.add('Accept-Encoding')
+
+        # Conditional requests. ETag is always computed on the
+        # uncompressed body.
+        if not response.is_streamed and not response.direct_passthrough:
+            if not response.get_etag()[0]:
+                response.add_etag()
+            response.make_conditional(request)
+            if response.status_code == 304:
+                return response
+
+        if not compressible(response):
+            return response
+        length = response.content_length
+        if length is not None and length < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        encoding = negotiate_encoding(available_encodings())
+        if encoding is None:
+            return response
+        level = app.config['COMPRESS_LEVEL'][encoding]
+
+        # Static responses (declared cacheable and carrying an ETag) are
+        # compressed once and served from memory afterwards.
+        etag, _ = response.get_etag()
+        cacheable = etag and (response.cache_control.public or
+                              response.cache_control.max_age)
+        if response.is_streamed and not cacheable:
+            response.response = compress_stream(
+                response.iter_encoded(),
+                encoding,
+                level
+            )
+            del response.headers['Content-Length']
+        else:
+            response.direct_passthrough = False
+            data = cache.get((etag, encoding)) if cacheable else None
+            if data is None:
+                data = compress(response.get_data(), encoding, level)
+                if cacheable:
+                    cache.set((etag, encoding), data)
+            response.set_data(data)
+        if etag:
+            # Compressed body is a different representation
+            response.set_etag(etag, weak=True)
+
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    return cache
@@ -44,3 +44,138 @@ if not USER_FOLDERS_PATH:
 # Set DEBUG to True during dev and False in production.
 LOG_FILE_PATH = os.getenv("LOG_FILE_PATH")
 DEBUG = True
+
+# Precomputed Swagger spec.
+# Folder where `flask export-swagger` writes swagger.json (+ .gz/.br) at
+# build time. If not set or empty, spec is generated once at startup.
+SWAGGER_SPEC_PATH = os.getenv("SWAGGER_SPEC_PATH")
+SWAGGER_SPEC_MAX_AGE = 86400  # Seconds clients and proxies may cache spec
+
+# Response compression and conditional requests.
+# Set COMPRESS_ENABLED to "0" when Nginx already compresses responses
+# (ETags and 304 responses are still handled by the app).
+COMPRESS_ENABLED = os.getenv("COMPRESS_ENABLED", "1") == "1"
+COMPRESS_MIN_SIZE = 500  # Bodies smaller than this (in bytes) are sent as is
+COMPRESS_LEVEL = {'gzip': 6, 'br': 4}
+COMPRESS_MIMETYPES = [
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/csv',
+    'application/json',
+    'application/javascript',
+]
+COMPRESS_CACHE_SIZE = 64  # Compressed static responses kept in memory
+
+# User administration API
+ADMIN_BATCH_SIZE = 1000  # Rows per bulk INSERT/UPDATE and per export fetch
+ADMIN_COPY_THRESHOLD = 5000  # Above this many emails, use COPY + join
+ADMIN_MAX_PAGE_SIZE = 1000
+
+# API usage metering.
+# Counters are kept in memory by each worker and written to db every
+# USAGE_FLUSH_INTERVAL seconds, aggregated by periods of USAGE_PERIOD seconds.
+USAGE_PERIOD = 3600
+USAGE_FLUSH_INTERVAL = 30
+USAGE_FLUSH_BATCH_SIZE = 500
+# Last flush of a stopping worker is tried USAGE_SHUTDOWN_RETRIES times, then
+# counters are written to USAGE_SPILL_PATH and flushed by another worker.
+USAGE_SHUTDOWN_RETRIES = 3
+USAGE_SPILL_PATH = os.getenv("USAGE_SPILL_PATH", "/tmp/flaskapp_usage")
+
+# Sessions.
+# "cookie" keeps Flask's signed cookie sessions. "memory" (one process,
+# dev only), "filesystem" (one node) or "shared" (all nodes) keep them
+# server side. The same store caches logged in users.
+SESSION_STORE = os.getenv("SESSION_STORE", "cookie")
+SESSION_FILE_PATH = os.getenv("SESSION_FILE_PATH", "/tmp/flaskapp_sessions")
+# redis:// URL of the shared store. If not set, an in-process fake is used.
+SESSION_SHARED_URL = os.getenv("SESSION_SHARED_URL")
+USER_CACHE_TTL = 300  # Seconds a logged in user is served from cache
+
+# Throttling of login, registration and password reset form POSTs.
+# Limits are per worker unless SESSION_STORE is set.
+THROTTLE_WINDOW = 60  # Seconds of the sliding window
+THROTTLE_IP_LIMIT = 30  # POSTs per window and IP
+THROTTLE_EMAIL_LIMIT = 10  # POSTs per window and email
+THROTTLE_BACKOFF_BASE = 1  # Seconds an email is blocked after a failure
+THROTTLE_BACKOFF_MAX = 900  # Backoff doubles on each failure, up to this
+THROTTLE_FAILURE_TTL = 3600  # Failures are forgotten after this
+THROTTLE_UNKNOWN_EMAIL_TTL = 300  # Unknown emails skip the db meanwhile
+
+# Request tracing.
+# If enabled, requests are traced randomly at TRACING_SAMPLE_RATE (0 to 1).
+# Traces continue the W3C traceparent header passed by Nginx. Its sampled
+# flag is only honoured if TRACING_TRUST_TRACEPARENT, i.e. when a proxy in
+# front sets or strips the header, as clients could set it too.
+# "file" exporter appends spans as JSON lines to TRACING_FILE_PATH, rotated
+# like log files, "memory" keeps them in tracer.exporter.spans (for tests).
+TRACING_ENABLED = os.getenv("TRACING_ENABLED") == "1"
+TRACING_SAMPLE_RATE = 0.01
+TRACING_TRUST_TRACEPARENT = os.getenv("TRACING_TRUST_TRACEPARENT") == "1"
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "file")
+TRACING_FILE_PATH = os.path.join(LOG_FILE_PATH or ".", "traces.jsonl")
+TRACING_FILE_MAX_BYTES = 100 * 1024 * 1024
+TRACING_FILE_BACKUP_COUNT = 5
+
+# On-demand profiling.
+# A request sent with a X-Profile header holding PROFILING_KEY is profiled,
+# admins can also profile a worker with POST /api/admin/profile.
+# Profiles are written to the PROFILING_PATH folder of the user files
+# storage (STORAGE_BACKEND), so that they are shared by all nodes.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED") == "1"
+PROFILING_KEY = os.getenv("PROFILING_KEY", "")
+PROFILING_INTERVAL = 0.005  # Seconds between two samples
+PROFILING_MAX_SECONDS = 60
+PROFILING_PATH = os.getenv("PROFILING_PATH", "_profiles")
+
+# SQL query budgets, checked in debug and testing modes or if
+# QUERY_BUDGET_ENABLED. Set QUERY_BUDGET_RAISE in tests so that a request
+# over budget fails instead of logging a warning.
+QUERY_BUDGET_ENABLED = os.getenv("QUERY_BUDGET_ENABLED") == "1"
+QUERY_BUDGET_RAISE = False
+QUERY_REPEAT_LIMIT = 3  # Same statement more times looks like a N+1
+
+# Shared state, for multi-node deployments (see README).
+# User files: "local" folders in USER_FOLDERS_PATH (can be a shared mount),
+# "s3" bucket or "memory" (tests).
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+STORAGE_S3_BUCKET = os.getenv("STORAGE_S3_BUCKET")
+STORAGE_S3_PREFIX = os.getenv("STORAGE_S3_PREFIX", "users/")
+# Number of load balancers in front of the node Nginx. Their
+# X-Forwarded-For gives the client IP used by login throttling. Leave to 0
+# when clients reach the node directly, or they could spoof their IP.
+PROXY_COUNT = int(os.getenv("PROXY_COUNT", "0"))
+# Emails: "sync" (sent inside the request), "local" or "shared" queue.
+MAIL_QUEUE = os.getenv("MAIL_QUEUE", "sync")
+MAIL_QUEUE_RETRIES = 3
+MAIL_QUEUE_RETRY_DELAY = 30  # Seconds, doubled on each attempt
+JOB_STATUS_TTL = 86400
+
+# Versioned datasets (see README). The latest version is always kept.
+DATASET_KEEP_VERSIONS = 10  # None keeps all
+DATASET_KEEP_SECONDS = None  # Drop versions older than this
+DATASET_LOCK_TTL = 600  # Longer than numbering a version (S3 copy)
+DATASET_LOCK_WAIT = 60
+
+# Idempotency-Key header of uploads: first successful response is replayed
+# to retries for IDEMPOTENCY_TTL seconds. Duplicates sent while the first
+# attempt runs get a 409, to retry after IDEMPOTENCY_RETRY_AFTER seconds.
+IDEMPOTENCY_TTL = 86400
+IDEMPOTENCY_LOCK_TTL = 3600  # Longer than the slowest upload
+IDEMPOTENCY_RETRY_AFTER = 5
+
+# Health checks. /readyz answers 503 when one of these limits is crossed.
+READY_MIN_DB_HEADROOM = 1  # Free connections left in the pool
+READY_MIN_FREE_DISK = 1024 ** 3  # Bytes free in USER_FOLDERS_PATH
+READY_MAX_MAIL_QUEUE = 1000
+
+# Admission control: shed requests with a fast 503 when the worker is
+# overloaded, low priority ones (Swagger UI, HTML pages) first.
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "1") == "1"
+ADMISSION_TARGET_LATENCY = 2.0  # Seconds, average of recent requests
+ADMISSION_LATENCY_HALF_LIFE = 10  # Seconds, average decays when idle
+ADMISSION_TARGET_QUEUE_TIME = 1.0  # Seconds waited before the worker
+ADMISSION_HIGH_PRIORITY_PRESSURE = 2  # API calls are shed later
+ADMISSION_LATENCY_ALPHA = 0.1  # Weight of last request in the average
+ADMISSION_RETRY_AFTER = 5
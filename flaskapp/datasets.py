@@ -0,0 +1,238 @@
+"""
+Versioned datasets of users.
+
+Each upload becomes a new version instead of overwriting the previous
+file. Versions of a dataset live in the user folder:
+- data/<name>/v000001.csv, data/<name>/v000002.csv... numbered from 1,
+never reused
+- data/<name>/manifest.json: size, sha256, row count and creation date of
+each kept version, so that consumers can tell what changed without
+reading the files
+
+A version file is written once and never modified, so it can be mmapped
+(local backend) or read by byte ranges (any backend) on its own.
+
+Retention keeps the DATASET_KEEP_VERSIONS last versions, and drops the
+ones older than DATASET_KEEP_SECONDS. The latest version is always kept.
+Files of dropped versions are deleted right after each upload, and by
+the gc-datasets command.
+"""
+
+from datetime import datetime
+import hashlib
+import io
+import json
+import mmap
+import time
+import uuid
+
+import click
+
+from sessions import MemoryStore
+from storage import storage
+from user_account.models import User
+
+# Datasets uploaded by the Build and Deploy namespaces
+NAMES = ('build', 'deploy')
+
+
+class DatasetBusy(Exception):
+    """Another upload of the same dataset holds the lock for too long."""
+
+
+class HashingReader(object):
+    """Binary stream wrapper computing size, sha256 and lines read."""
+
+    def __init__(self, stream):
+        """Wrap stream."""
+        self.stream = stream
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.newlines = 0
+        self.last = b''
+
+    def read(self, size=-1):
+        """Read from stream and update counts."""
+        data = self.stream.read(size)
+        if data:
+            self.sha256.update(data)
+            self.size += len(data)
+            self.newlines += data.count(b'\n')
+            self.last = data[-1:]
+        return data
+
+    @property
+    def rows(self):
+        """Lines read, including a last line without newline."""
+        if self.size and self.last != b'\n':
+            return self.newlines + 1
+        return self.newlines
+
+
+class DatasetStore(object):
+    """Versions and manifests of datasets, on top of user storage."""
+
+    def __init__(self):
+        """Store is set by init_app."""
+        self.store = MemoryStore()
+        self.config = {}
+
+    def init_app(self, app, store=None):
+        """Use the session store if any, so that all workers share locks."""
+        if store is not None:
+            self.store = store
+        self.config = app.config
+
+        @app.cli.command('gc-datasets')
+        def gc_datasets():
+            """Apply retention to datasets of all users."""
+            dropped = 0
+            for user in User.query.yield_per(1000):
+                for name in NAMES:
+                    dropped += self.gc(user, name)
+            click.echo("{} dataset versions dropped.".format(dropped))
+
+    @staticmethod
+    def folder(name):
+        """Folder of dataset, relative to user folder."""
+        return 'data/{}'.format(name)
+
+    def path(self, name, version):
+        """File of a version, relative to user folder."""
+        return '{}/v{:06d}.csv'.format(self.folder(name), version)
+
+    def versions(self, user, name):
+        """Manifest entries of kept versions, oldest first."""
+        try:
+            f = storage.open(
+                user,
+                '{}/manifest.json'.format(self.folder(name))
+            )
+        except FileNotFoundError:
+            return []
+        try:
+            return json.loads(f.read().decode('utf-8'))['versions']
+        finally:
+            f.close()
+
+    def get(self, user, name, version):
+        """Manifest entry of a version, None if unknown or dropped."""
+        for entry in self.versions(user, name):
+            if entry['version'] == version:
+                return entry
+        return None
+
+    def write_versions(self, user, name, versions):
+        """Replace manifest, atomically."""
+        data = json.dumps({'versions': versions}, separators=(',', ':'))
+        storage.save_stream(
+            user,
+            '{}/manifest.json'.format(self.folder(name)),
+            io.BytesIO(data.encode('utf-8'))
+        )
+
+    def lock(self, user, name):
+        """
+        Take lock of dataset, so that versions are numbered in sequence.
+
+        Raise DatasetBusy after DATASET_LOCK_WAIT seconds.
+        """
+        key = 'dataset-lock:{}:{}'.format(user.id, name)
+        deadline = time.time() + self.config['DATASET_LOCK_WAIT']
+        while not self.store.add(key, 1, self.config['DATASET_LOCK_TTL']):
+            if time.time() > deadline:
+                raise DatasetBusy(name)
+            time.sleep(0.1)
+        return key
+
+    def expired(self, versions):
+        """Split versions into kept and dropped ones, by retention."""
+        keep = self.config['DATASET_KEEP_VERSIONS']
+        max_age = self.config['DATASET_KEEP_SECONDS']
+        kept = versions[-keep:] if keep else list(versions)
+        if max_age:
+            oldest = datetime.utcfromtimestamp(time.time() - max_age)
+            kept = [
+                entry for entry in kept[:-1]
+                if entry['created_at'] >= oldest.isoformat()
+            ] + kept[-1:]
+        numbers = set(entry['version'] for entry in kept)
+        dropped = [
+            entry for entry in versions if entry['version'] not in numbers
+        ]
+        return kept, dropped
+
+    def add(self, user, name, stream):
+        """
+        Save binary stream as the next version of dataset.
+
+        Stream is written to a temporary file first, so the lock is only
+        held to number the version and update the manifest.
+        Return manifest entry of the new version.
+        """
+        storage.makedirs(user, self.folder(name))
+        tmp_path = '{}/upload-{}.tmp'.format(
+            self.folder(name),
+            uuid.uuid4().hex
+        )
+        reader = HashingReader(stream)
+        try:
+            storage.save_stream(user, tmp_path, reader)
+            key = self.lock(user, name)
+        except BaseException:
+            storage.delete(user, tmp_path)
+            raise
+        try:
+            versions = self.versions(user, name)
+            version = versions[-1]['version'] + 1 if versions else 1
+            storage.rename(user, tmp_path, self.path(name, version))
+            entry = {
+                'version': version,
+                'size': reader.size,
+                'sha256': reader.sha256.hexdigest(),
+                'rows': reader.rows,
+                'created_at': datetime.utcnow().isoformat(),
+            }
+            versions, dropped = self.expired(versions + [entry])
+            self.write_versions(user, name, versions)
+        finally:
+            self.store.delete(key)
+
+        self.delete_files(user, name, dropped)
+        return entry
+
+    def delete_files(self, user, name, entries):
+        """Delete files of dropped versions."""
+        for entry in entries:
+            storage.delete(user, self.path(name, entry['version']))
+
+    def gc(self, user, name):
+        """Apply retention to dataset. Return number of dropped versions."""
+        key = self.lock(user, name)
+        try:
+            versions, dropped = self.expired(self.versions(user, name))
+            if dropped:
+                self.write_versions(user, name, versions)
+        finally:
+            self.store.delete(key)
+        self.delete_files(user, name, dropped)
+        return len(dropped)
+
+    def open(self, user, name, version, start=0):
+        """Open file of a version for reading from byte start."""
+        return storage.open(user, self.path(name, version), start)
+
+    def mmap(self, user, name, version):
+        """
+        Memory map file of a version, read only.
+
+        Only with the local backend.
+        """
+        path = storage.local_path(user, self.path(name, version))
+        if path is None:
+            raise RuntimeError("mmap needs STORAGE_BACKEND=local.")
+        with open(path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+datasets = DatasetStore()
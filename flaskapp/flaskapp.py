@@ -1,14 +1,33 @@
 """Dispatching logic to multiple blueprints."""
 
 from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-from apis import blueprint as api
+from apis import blueprint as api, api as restplus_api
+from apis.idempotency import idempotency
+from apis.swagger import init_spec_cache
+from apis.usage import init_usage_metering
+from compression import init_compression
+from datasets import datasets
+from health import admission, health_pages
+from profiling import profiler
+from query_budget import query_counter
+from mail_queue import mail_queue
+from sessions import init_sessions
+from storage import storage
+from tracing import tracer
 from user_account.views import user_account_pages
+from user_account.throttle import throttle
 
-from setup import app, db, mail, login_manager
+from setup import app, db, mail, login_manager, user_cache
 
 app.register_blueprint(api, url_prefix='/api')
 app.register_blueprint(user_account_pages, url_prefix='/home')
+app.register_blueprint(health_pages)
+
+# Client IP from X-Forwarded-For, only set by trusted load balancers
+if app.config['PROXY_COUNT']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_COUNT'])
 
 db.init_app(app)
 migrate = Migrate(app, db)
@@ -16,5 +35,31 @@ mail.init_app(app)
 login_manager.init_app(app)
 login_manager.login_view = "user_account_pages.login"
 
+# Shed low priority requests first when overloaded, before any other hook
+admission.init_app(app)
+# Trace sampled requests (no cost when TRACING_ENABLED is off)
+tracer.init_app(app)
+# On-demand profiling (no cost when PROFILING_ENABLED is off)
+profiler.init_app(app)
+# Count SQL queries per request against budgets (debug and tests)
+query_counter.init_app(app)
+# Server side sessions and cache of logged in users, if configured
+store = init_sessions(app, user_cache)
+# Reject abusive login/register/reset POSTs before db access
+throttle.init_app(app, store)
+# Replay responses of retried uploads sent with an Idempotency-Key
+idempotency.init_app(app, store)
+# Shared backends needed to run several nodes
+storage.init_app(app)
+datasets.init_app(app, store)
+mail_queue.init_app(app, mail, store)
+
+# Build Swagger spec once, before workers start serving traffic
+init_spec_cache(app, restplus_api)
+# Count API calls and bytes per user, written to db in the background
+init_usage_metering(app)
+# Compress responses and answer conditional GETs on all blueprints
+init_compression(app)
+
 if __name__ == '__main__':
     app.run()
@@ -0,0 +1,189 @@
+"""
+Health checks and admission control.
+
+- /healthz: liveness, the process answers
+- /readyz: readiness, the database pool has headroom, user folders disk
+is not full and the mail queue is not piling up
+
+Under overload, the admission controller answers a fast 503 instead of
+letting requests wait in the uwsgi listen queue until they time out.
+Pressure is the highest of these ratios:
+- average latency of recent requests / ADMISSION_TARGET_LATENCY
+- time spent queued before reaching the worker (X-Request-Start header
+set by Nginx) / ADMISSION_TARGET_QUEUE_TIME
+Low priority requests (Swagger UI, HTML pages) are shed from pressure 1,
+authenticated API calls only from ADMISSION_HIGH_PRIORITY_PRESSURE.
+
+Views whose duration depends on the size of what they transfer (uploads,
+downloads) are marked with @long_request and left out of the average.
+The average decays with a ADMISSION_LATENCY_HALF_LIFE seconds half-life,
+so that a worker shedding everything recovers once load drops.
+"""
+
+from functools import wraps
+import shutil
+import threading
+import time
+
+from flask import Blueprint, g, jsonify, request
+
+from mail_queue import mail_queue
+from setup import app, db
+
+health_pages = Blueprint('health', __name__)
+
+# API endpoints considered low priority, like HTML pages
+LOW_PRIORITY_API_ENDPOINTS = ('api.doc', 'api.specs', 'api.root')
+
+
+def long_request(f):
+    """Leave requests to this view out of the latency average."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        """Mark current request."""
+        g.admission_long_request = True
+        return f(*args, **kwargs)
+    return decorated
+
+
+@health_pages.route('/healthz')
+def healthz():
+    """Liveness: the worker is able to answer."""
+    return jsonify({'status': 'ok'})
+
+
+def check_database():
+    """Database answers and its connection pool has headroom."""
+    db.session.execute(db.text('SELECT 1'))
+    pool = db.engine.pool
+    capacity = pool.size() + max(getattr(pool, '_max_overflow', 0), 0)
+    headroom = capacity - pool.checkedout()
+    return headroom >= app.config['READY_MIN_DB_HEADROOM'], {
+        'headroom': headroom
+    }
+
+
+def check_disk():
+    """Disk of user folders is not full."""
+    if app.config['STORAGE_BACKEND'] != 'local':
+        return True, {'backend': app.config['STORAGE_BACKEND']}
+    free = shutil.disk_usage(app.config['USER_FOLDERS_PATH']).free
+    return free >= app.config['READY_MIN_FREE_DISK'], {'free': free}
+
+
+def check_mail_queue():
+    """Emails are not piling up."""
+    depth = mail_queue.depth()
+    return depth <= app.config['READY_MAX_MAIL_QUEUE'], {'depth': depth}
+
+
+@health_pages.route('/readyz')
+def readyz():
+    """Readiness: dependencies are able to take more traffic."""
+    checks = {}
+    ready = True
+    for name, check in (('database', check_database),
+                        ('disk', check_disk),
+                        ('mail_queue', check_mail_queue)):
+        try:
+            ok, details = check()
+        except Exception as e:
+            ok, details = False, {'error': str(e)}
+        details['ok'] = ok
+        checks[name] = details
+        ready = ready and ok
+    status = 200 if ready else 503
+    return jsonify({'status': 'ok' if ready else 'unavailable',
+                    'checks': checks}), status
+
+
+class AdmissionController(object):
+    """Shed low priority requests first when the worker is overloaded."""
+
+    def __init__(self):
+        """Disabled until init_app."""
+        self.app = None
+        self.latency = 0.0
+        self.updated = time.time()
+        self.lock = threading.Lock()
+        self.shed = 0
+
+    def init_app(self, app):
+        """Register hooks if ADMISSION_CONTROL is on."""
+        if not app.config['ADMISSION_CONTROL']:
+            return
+        self.app = app
+        app.before_request(self.admit)
+        app.teardown_request(self.release)
+
+    @staticmethod
+    def priority():
+        """Priority of current request: None (never shed), low or high."""
+        endpoint = request.endpoint or ''
+        if endpoint.startswith('health.'):
+            return None
+        if (endpoint.startswith('api.') and
+                endpoint not in LOW_PRIORITY_API_ENDPOINTS):
+            return 'high'
+        return 'low'
+
+    def queue_time(self):
+        """Seconds spent before reaching the worker, from X-Request-Start."""
+        header = request.headers.get('X-Request-Start', '')
+        try:
+            start = float(header.replace('t=', ''))
+        except ValueError:
+            return 0.0
+        return max(time.time() - start, 0.0)
+
+    def average_latency(self, now):
+        """Latency average, decayed since last update."""
+        half_life = self.app.config['ADMISSION_LATENCY_HALF_LIFE']
+        return self.latency * 0.5 ** ((now - self.updated) / half_life)
+
+    def pressure(self):
+        """Overload level, 1 meaning at capacity."""
+        return max(
+            self.average_latency(time.time()) /
+            self.app.config['ADMISSION_TARGET_LATENCY'],
+            self.queue_time() / self.app.config['ADMISSION_TARGET_QUEUE_TIME'],
+        )
+
+    def admit(self):
+        """Answer a fast 503 if request must be shed."""
+        priority = self.priority()
+        if priority is not None:
+            limit = 1
+            if priority == 'high':
+                limit = self.app.config['ADMISSION_HIGH_PRIORITY_PRESSURE']
+            if self.pressure() >= limit:
+                # Logging every shed request would wipe the log under
+                # overload: log the first one, then one every 1000
+                if self.shed % 1000 == 0:
+                    self.app.logger.warning(
+                        "Shedding {} priority request to {} ({} shed so "
+                        "far).".format(priority, request.path, self.shed + 1)
+                    )
+                self.shed += 1
+                response = jsonify({'message': 'Server overloaded.'})
+                response.status_code = 503
+                response.headers['Retry-After'] = str(
+                    self.app.config['ADMISSION_RETRY_AFTER']
+                )
+                return response
+        g.admission_start = time.time()
+
+    def release(self, exc):
+        """Add latency of admitted request to the average."""
+        start = g.pop('admission_start', None)
+        if start is None or g.pop('admission_long_request', False):
+            return
+        now = time.time()
+        alpha = self.app.config['ADMISSION_LATENCY_ALPHA']
+        with self.lock:
+            self.latency = (alpha * (now - start) +
+                            (1 - alpha) * self.average_latency(now))
+            self.updated = now
+
+
+admission = AdmissionController()
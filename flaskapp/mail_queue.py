@@ -0,0 +1,185 @@
+"""
+Queue of emails to send.
+
+mail.send() is a SMTP round trip. Depending on MAIL_QUEUE, emails are:
+- sync: sent right away inside the request, as before
+- local: queued in the current process and sent by a thread of it
+- shared: queued in the shared store (SESSION_STORE=shared), and sent by
+a thread started in every worker of every node
+
+A failed email is sent again after MAIL_QUEUE_RETRY_DELAY seconds, doubled
+on each attempt, up to MAIL_QUEUE_RETRIES attempts.
+
+Each email is a job whose status (queued, sent, failed) is kept in the
+session store for JOB_STATUS_TTL seconds.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+from flask_mail import Message
+
+from sessions import MemoryStore
+from setup import on_worker_exit, on_worker_start
+
+QUEUE_KEY = 'mail_queue'
+
+
+class MailQueue(object):
+    """Send emails now or through a queue."""
+
+    def __init__(self):
+        """Sync until init_app."""
+        self.app = None
+        self.mail = None
+        self.kind = 'sync'
+        self.store = MemoryStore()
+        self.local = queue.Queue()
+        self.pid = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def init_app(self, app, mail, store=None):
+        """Use the session store for shared queue and job status."""
+        self.app = app
+        self.mail = mail
+        self.kind = app.config['MAIL_QUEUE']
+        if store is not None:
+            self.store = store
+        if self.kind == 'shared' and not hasattr(self.store, 'push'):
+            raise RuntimeError("MAIL_QUEUE=shared needs SESSION_STORE=shared.")
+
+        # Jobs queued by any node are sent even by workers that queue none
+        if self.kind == 'shared':
+            on_worker_start(self.ensure_consumer)
+        on_worker_exit(self.shutdown)
+
+    def set_status(self, job_id, status):
+        """Keep job status for JOB_STATUS_TTL seconds."""
+        self.store.set(
+            'job:{}'.format(job_id),
+            status,
+            self.app.config['JOB_STATUS_TTL']
+        )
+
+    def status(self, job_id):
+        """Status of job, None if unknown or expired."""
+        return self.store.get('job:{}'.format(job_id))
+
+    def send(self, msg):
+        """Send or queue a flask_mail Message. Return its job id."""
+        job = {
+            'id': uuid.uuid4().hex,
+            'attempts': 0,
+            'retry_at': 0,
+            'subject': msg.subject,
+            'recipients': msg.recipients,
+            'html': msg.html,
+        }
+        if self.kind == 'sync':
+            self.deliver(job)
+            return job['id']
+        self.set_status(job['id'], 'queued')
+        self.enqueue(job)
+        self.ensure_consumer()
+        return job['id']
+
+    def enqueue(self, job):
+        """Put job in queue."""
+        if self.kind == 'shared':
+            self.store.push(QUEUE_KEY, json.dumps(job))
+        else:
+            self.local.put(job)
+
+    def dequeue(self, timeout):
+        """Get next job, None after timeout seconds."""
+        if self.kind == 'shared':
+            data = self.store.pop(QUEUE_KEY, timeout)
+            return json.loads(data) if data is not None else None
+        try:
+            return self.local.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def depth(self):
+        """Number of emails waiting to be sent."""
+        if self.kind == 'shared':
+            return self.store.length(QUEUE_KEY)
+        return self.local.qsize()
+
+    def deliver(self, job):
+        """Send email of job, queue it again for later on failure."""
+        try:
+            # Message reads the default sender from the app
+            with self.app.app_context():
+                msg = Message(
+                    job['subject'],
+                    recipients=job['recipients'],
+                    html=job['html']
+                )
+                self.mail.send(msg)
+        except Exception:
+            job['attempts'] += 1
+            self.app.logger.exception(
+                "Could not send email {} (attempt {}).".format(
+                    job['id'], job['attempts']
+                )
+            )
+            if self.kind != 'sync' and (
+                    job['attempts'] < self.app.config['MAIL_QUEUE_RETRIES']):
+                job['retry_at'] = time.time() + (
+                    self.app.config['MAIL_QUEUE_RETRY_DELAY']
+                    * 2 ** (job['attempts'] - 1)
+                )
+                self.enqueue(job)
+                return
+            self.set_status(job['id'], 'failed')
+            if self.kind == 'sync':
+                raise
+            return
+        self.set_status(job['id'], 'sent')
+
+    def ensure_consumer(self):
+        """Start consumer thread once per process, after uwsgi fork."""
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+        consumer = threading.Thread(target=self.run, name='mail-queue')
+        consumer.daemon = True
+        consumer.start()
+
+    def run(self):
+        """Send queued emails until stopped."""
+        while not self.stopped.is_set():
+            job = self.dequeue(timeout=1)
+            if job is None:
+                continue
+            wait = job.get('retry_at', 0) - time.time()
+            if wait > 0:
+                # Not due yet: back in the queue, without spinning on it
+                self.enqueue(job)
+                self.stopped.wait(min(wait, 1))
+                continue
+            self.deliver(job)
+
+    def shutdown(self):
+        """Stop consumer and send emails left in the local queue."""
+        self.stopped.set()
+        if self.kind != 'local':
+            return
+        while True:
+            try:
+                job = self.local.get_nowait()
+            except queue.Empty:
+                break
+            self.deliver(job)
+
+
+mail_queue = MailQueue()
@@ -0,0 +1,57 @@
+"""Admin flag and indexes for user listings
+
+Revision ID: 4c2e8f1a7b3d
+Revises: d97426b66ffd
+Create Date: 2026-10-19 10:12:43.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c2e8f1a7b3d'
+down_revision = 'd97426b66ffd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'flask_user',
+        sa.Column(
+            'is_admin',
+            sa.Boolean(),
+            server_default=sa.false(),
+            nullable=False
+        )
+    )
+    # Built without locking writes. Indexes on email use the "C" collation:
+    # the same index serves keyset pagination (ORDER BY, >) and prefix
+    # search (LIKE 'prefix%'), which the database collation may not allow.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_flask_user_is_premium_email',
+            'flask_user',
+            ['is_premium', sa.text('email COLLATE "C"')],
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_flask_user_confirmed_email',
+            'flask_user',
+            ['confirmed', sa.text('email COLLATE "C"')],
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_flask_user_email_c',
+            'flask_user',
+            [sa.text('email COLLATE "C"')],
+            postgresql_concurrently=True
+        )
+
+
+def downgrade():
+    op.drop_index('ix_flask_user_email_c', table_name='flask_user')
+    op.drop_index('ix_flask_user_confirmed_email', table_name='flask_user')
+    op.drop_index('ix_flask_user_is_premium_email', table_name='flask_user')
+    op.drop_column('flask_user', 'is_admin')
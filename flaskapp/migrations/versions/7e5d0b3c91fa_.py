@@ -0,0 +1,166 @@
+"""Integer primary key for flask_user
+
+Revision ID: 7e5d0b3c91fa
+Revises: 4c2e8f1a7b3d
+Create Date: 2026-10-19 14:03:27.540912
+
+Email was the primary key. It is replaced by an integer id, email stays
+unique case insensitively. Existing rows are backfilled by batches of
+BATCH_SIZE rows, each committed on its own, and indexes are built
+CONCURRENTLY, so that big tables are not locked for long. The primary key
+is swapped in a short transaction, using an index built beforehand.
+Emails that only differ by case must be merged before upgrading, the
+migration lists them and stops otherwise.
+Once done, run `flask move-user-folders` to rename user folders.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e5d0b3c91fa'
+down_revision = '4c2e8f1a7b3d'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+
+
+def check_email_case_duplicates(conn):
+    """Stop if some emails only differ by case, they cannot be unique."""
+    duplicates = conn.execute(sa.text(
+        "SELECT lower(email), array_agg(email ORDER BY email) "
+        "FROM flask_user GROUP BY lower(email) HAVING count(*) > 1 "
+        "ORDER BY lower(email) LIMIT 100"
+    )).fetchall()
+    if duplicates:
+        raise RuntimeError(
+            "Emails only differing by case, merge these users first "
+            "(100 first shown):\n{}".format('\n'.join(
+                ', '.join(emails) for _, emails in duplicates
+            ))
+        )
+
+
+def upgrade():
+    conn = op.get_bind()
+    check_email_case_duplicates(conn)
+
+    op.add_column('flask_user', sa.Column('id', sa.Integer(), nullable=True))
+    op.execute("CREATE SEQUENCE flask_user_id_seq OWNED BY flask_user.id")
+    # New rows get an id right away, even during backfill
+    op.execute(
+        "ALTER TABLE flask_user "
+        "ALTER COLUMN id SET DEFAULT nextval('flask_user_id_seq')"
+    )
+
+    with op.get_context().autocommit_block():
+        # Backfill by walking the email primary key
+        last_email = ''
+        while True:
+            emails = [row[0] for row in conn.execute(
+                sa.text(
+                    "SELECT email FROM flask_user WHERE email > :last_email "
+                    "ORDER BY email LIMIT :batch_size"
+                ),
+                {'last_email': last_email, 'batch_size': BATCH_SIZE}
+            )]
+            if not emails:
+                break
+            conn.execute(
+                sa.text(
+                    "UPDATE flask_user SET id = nextval('flask_user_id_seq') "
+                    "WHERE email = ANY(:emails) AND id IS NULL"
+                ),
+                {'emails': emails}
+            )
+            last_email = emails[-1]
+
+        # Checked without blocking writes, so that SET NOT NULL does not
+        # scan the table (PostgreSQL 12+)
+        op.execute(
+            "ALTER TABLE flask_user ADD CONSTRAINT flask_user_id_not_null "
+            "CHECK (id IS NOT NULL) NOT VALID"
+        )
+        op.execute(
+            "ALTER TABLE flask_user VALIDATE CONSTRAINT flask_user_id_not_null"
+        )
+        op.create_index(
+            'flask_user_id_key',
+            'flask_user',
+            ['id'],
+            unique=True,
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ux_flask_user_email_lower',
+            'flask_user',
+            [sa.text('lower(email)')],
+            unique=True,
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_flask_user_premium',
+            'flask_user',
+            [sa.text('email COLLATE "C"')],
+            postgresql_where=sa.text('is_premium'),
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_flask_user_unconfirmed',
+            'flask_user',
+            ['registered_on'],
+            postgresql_where=sa.text('NOT confirmed'),
+            postgresql_concurrently=True
+        )
+        # Premium users are covered by the partial index above, the others
+        # by ix_flask_user_email_c
+        op.drop_index(
+            'ix_flask_user_is_premium_email',
+            table_name='flask_user',
+            postgresql_concurrently=True
+        )
+
+    # Email unique index goes with the old primary key, email uniqueness
+    # is enforced by ux_flask_user_email_lower
+    op.alter_column('flask_user', 'id', nullable=False)
+    op.drop_constraint('flask_user_pkey', 'flask_user', type_='primary')
+    op.execute(
+        "ALTER TABLE flask_user ADD CONSTRAINT flask_user_pkey "
+        "PRIMARY KEY USING INDEX flask_user_id_key"
+    )
+    op.drop_constraint('flask_user_id_not_null', 'flask_user', type_='check')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_flask_user_is_premium_email',
+            'flask_user',
+            ['is_premium', sa.text('email COLLATE "C"')],
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'flask_user_email_key',
+            'flask_user',
+            ['email'],
+            unique=True,
+            postgresql_concurrently=True
+        )
+        for name in [
+            'ix_flask_user_unconfirmed',
+            'ix_flask_user_premium',
+            'ux_flask_user_email_lower',
+        ]:
+            op.drop_index(
+                name,
+                table_name='flask_user',
+                postgresql_concurrently=True
+            )
+    op.drop_constraint('flask_user_pkey', 'flask_user', type_='primary')
+    op.execute(
+        "ALTER TABLE flask_user ADD CONSTRAINT flask_user_pkey "
+        "PRIMARY KEY USING INDEX flask_user_email_key"
+    )
+    op.drop_column('flask_user', 'id')
@@ -0,0 +1,35 @@
+"""API usage table
+
+Revision ID: a81f4c6d2e57
+Revises: 7e5d0b3c91fa
+Create Date: 2026-10-19 16:47:09.302118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a81f4c6d2e57'
+down_revision = '7e5d0b3c91fa'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('api_usage',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('endpoint', sa.String(length=100), nullable=False),
+    sa.Column('period_start', sa.DateTime(), nullable=False),
+    sa.Column('calls', sa.BigInteger(), nullable=False),
+    sa.Column('bytes_in', sa.BigInteger(), nullable=False),
+    sa.Column('bytes_out', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(
+        ['user_id'], ['flask_user.id'], ondelete='CASCADE'
+    ),
+    sa.PrimaryKeyConstraint('user_id', 'endpoint', 'period_start')
+    )
+
+
+def downgrade():
+    op.drop_table('api_usage')
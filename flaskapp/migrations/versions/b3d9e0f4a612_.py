@@ -0,0 +1,32 @@
+"""API token version
+
+Revision ID: b3d9e0f4a612
+Revises: a81f4c6d2e57
+Create Date: 2026-10-19 18:21:55.671430
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d9e0f4a612'
+down_revision = 'a81f4c6d2e57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'flask_user',
+        sa.Column(
+            'token_version',
+            sa.Integer(),
+            server_default='0',
+            nullable=False
+        )
+    )
+
+
+def downgrade():
+    op.drop_column('flask_user', 'token_version')
@@ -0,0 +1,256 @@
+"""
+On-demand profiling of live workers.
+
+A sampling profiler reads the stacks of running threads at a fixed
+interval and counts them in collapsed-stack format ("a;b;c count"), which
+flamegraph.pl or speedscope turn into a flamegraph. It can run:
+- for one request, sent with a X-Profile header holding PROFILING_KEY,
+along with a log of its SQL queries and their timings
+- for N seconds on the worker serving POST /api/admin/profile, in the
+background so that the worker keeps serving (and profiling) real traffic
+
+Profiles are written as JSON files to the PROFILING_PATH folder of the
+user files storage, so any worker of any node can serve them. When
+PROFILING_ENABLED is off nothing is hooked.
+"""
+
+from collections import Counter
+import hmac
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from storage import storage
+
+
+def collapse(frame):
+    """Collapse a stack as "outermost;...;innermost" function names."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{}:{}'.format(
+            os.path.basename(code.co_filename),
+            code.co_name
+        ))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler(object):
+    """Thread sampling stacks of other threads of the process."""
+
+    def __init__(self, interval, thread_id=None):
+        """Only sample thread_id if given, all threads otherwise."""
+        self.interval = interval
+        self.thread_id = thread_id
+        # Threads of the profiler itself, not worth sampling
+        self.ignored = set()
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='profiler')
+        self.thread.daemon = True
+
+    def ignore(self, thread):
+        """Do not sample thread. Call it before the thread starts."""
+        self.ignored.add(thread)
+
+    def start(self):
+        """Start sampling."""
+        self.thread.start()
+
+    def run(self):
+        """Sample stacks until stopped."""
+        own_id = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            # Threads are known by object, their ident only exists once
+            # they run
+            ignored = {thread.ident for thread in tuple(self.ignored)}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or thread_id in ignored:
+                    continue
+                if self.thread_id is not None and thread_id != self.thread_id:
+                    continue
+                self.stacks[collapse(frame)] += 1
+
+    def stop(self):
+        """Stop sampling and wait for the sampling thread."""
+        self.stopped.set()
+        self.thread.join()
+
+    def folded(self):
+        """Stacks in collapsed-stack format."""
+        return '\n'.join(
+            '{} {}'.format(stack, count)
+            for stack, count in self.stacks.most_common()
+        )
+
+
+class Profiler(object):
+    """Profiling sessions of the current worker."""
+
+    def __init__(self):
+        """Disabled until init_app."""
+        self.enabled = False
+        self.config = {}
+        # One worker-wide session at a time
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        """Register request and SQLAlchemy hooks if profiling is enabled."""
+        self.enabled = app.config['PROFILING_ENABLED']
+        if not self.enabled:
+            return
+        self.config = app.config
+
+        app.before_request(self.start_request_profile)
+        app.after_request(self.add_profile_header)
+        app.teardown_request(self.end_request_profile)
+        event.listen(Engine, 'before_cursor_execute', self.start_query)
+        event.listen(Engine, 'after_cursor_execute', self.end_query)
+
+    @staticmethod
+    def new_id(kind):
+        """Unique profile id, also its file name."""
+        return '{}-{}-{}-{}'.format(
+            kind,
+            os.getpid(),
+            int(time.time()),
+            os.urandom(4).hex()
+        )
+
+    def save(self, profile_id, data):
+        """Write profile to storage, atomically, and return its id."""
+        data['pid'] = os.getpid()
+        storage.backend.makedirs(self.config['PROFILING_PATH'])
+        storage.backend.save(
+            '{}/{}'.format(self.config['PROFILING_PATH'], profile_id),
+            io.BytesIO(json.dumps(data).encode('utf-8'))
+        )
+        return profile_id
+
+    def load(self, profile_id):
+        """Read a profile, None if not found."""
+        name = os.path.basename(profile_id)
+        try:
+            f = storage.backend.open(
+                '{}/{}'.format(self.config['PROFILING_PATH'], name)
+            )
+        except FileNotFoundError:
+            return None
+        try:
+            return json.loads(f.read().decode('utf-8'))
+        finally:
+            f.close()
+
+    def profile_worker(self, seconds):
+        """
+        Sample all threads of this worker for some seconds, in background.
+
+        Return the profile id right away, or None if a session is already
+        running. Until sampling ends, the profile is saved with a "running"
+        status.
+        """
+        if not self.lock.acquire(blocking=False):
+            return None
+        seconds = min(seconds, self.config['PROFILING_MAX_SECONDS'])
+        profile_id = self.new_id('worker')
+        sampler = Sampler(self.config['PROFILING_INTERVAL'])
+        try:
+            self.save(profile_id, {
+                'status': 'running',
+                'seconds': seconds,
+                'ends_at': time.time() + seconds,
+            })
+            timer = threading.Timer(
+                seconds,
+                self.end_worker_profile,
+                (profile_id, sampler, seconds)
+            )
+            timer.daemon = True
+            sampler.ignore(timer)
+            sampler.start()
+            timer.start()
+        except BaseException:
+            sampler.stopped.set()
+            self.lock.release()
+            raise
+        return profile_id
+
+    def end_worker_profile(self, profile_id, sampler, seconds):
+        """Stop sampling and save the worker profile. Run by a timer."""
+        try:
+            sampler.stop()
+            self.save(profile_id, {
+                'status': 'done',
+                'seconds': seconds,
+                'stacks': sampler.folded(),
+            })
+        finally:
+            self.lock.release()
+
+    def start_request_profile(self):
+        """Profile request if it holds the right X-Profile header."""
+        key = self.config['PROFILING_KEY']
+        header = request.headers.get('X-Profile')
+        if not key or not header:
+            return
+        if not hmac.compare_digest(header.encode(), key.encode()):
+            return
+        sampler = Sampler(
+            self.config['PROFILING_INTERVAL'],
+            threading.get_ident()
+        )
+        g.profile = {
+            'id': self.new_id('request'),
+            'sampler': sampler,
+            'queries': [],
+            'start': time.time(),
+        }
+        sampler.start()
+
+    def add_profile_header(self, response):
+        """Tell client where its profile will be."""
+        profile = g.get('profile')
+        if profile is not None:
+            response.headers['X-Profile-Id'] = profile['id']
+        return response
+
+    def end_request_profile(self, exc):
+        """Stop sampling and save the request profile."""
+        profile = g.get('profile')
+        if profile is None:
+            return
+        g.profile = None
+        profile['sampler'].stop()
+        self.save(profile['id'], {
+            'path': request.path,
+            'duration': time.time() - profile['start'],
+            'stacks': profile['sampler'].folded(),
+            'queries': profile['queries'],
+        })
+
+    def start_query(self, conn, cursor, statement, parameters, context,
+                    executemany):
+        """Time SQL query of a profiled request."""
+        if has_request_context() and g.get('profile') is not None:
+            context._profile_start = time.time()
+
+    def end_query(self, conn, cursor, statement, parameters, context,
+                  executemany):
+        """Log SQL query of a profiled request with its duration."""
+        start = getattr(context, '_profile_start', None)
+        if start is not None and g.get('profile') is not None:
+            g.profile['queries'].append({
+                'statement': statement,
+                'duration': time.time() - start,
+            })
+
+
+profiler = Profiler()
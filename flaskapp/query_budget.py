@@ -0,0 +1,111 @@
+"""
+SQL query budgets.
+
+SQL queries and their time are counted per request through SQLAlchemy
+engine events. Views declare how many queries they may run with
+@query_budget(n). Going over budget logs a warning, or raises
+QueryBudgetExceeded if QUERY_BUDGET_RAISE is set (e.g. in tests).
+A statement run more than QUERY_REPEAT_LIMIT times in a request is
+reported as a possible N+1. In debug mode, counts are also sent in the
+X-Query-Count and X-Query-Time response headers.
+
+Only hooked in debug or testing mode, or with QUERY_BUDGET_ENABLED.
+"""
+
+from collections import Counter
+from functools import wraps
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceeded(Exception):
+    """Request ran more SQL queries than its view declared."""
+
+
+def query_budget(max_queries):
+    """Declare how many SQL queries a request to this view may run."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            """Set budget of current request."""
+            g.query_budget = max_queries
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+
+class QueryCounter(object):
+    """Count SQL queries of requests and check them against budgets."""
+
+    def __init__(self):
+        """Disabled until init_app."""
+        self.enabled = False
+        self.app = None
+
+    def init_app(self, app):
+        """Register request and SQLAlchemy hooks if enabled."""
+        self.enabled = (app.debug or app.testing or
+                        app.config['QUERY_BUDGET_ENABLED'])
+        if not self.enabled:
+            return
+        self.app = app
+
+        app.after_request(self.check_budget)
+        event.listen(Engine, 'before_cursor_execute', self.start_query)
+        event.listen(Engine, 'after_cursor_execute', self.end_query)
+
+    def start_query(self, conn, cursor, statement, parameters, context,
+                    executemany):
+        """Remember when query started."""
+        if has_request_context():
+            context._budget_start = time.time()
+
+    def end_query(self, conn, cursor, statement, parameters, context,
+                  executemany):
+        """Count query of current request."""
+        start = getattr(context, '_budget_start', None)
+        if start is None:
+            return
+        if 'query_stats' not in g:
+            g.query_stats = {'count': 0, 'time': 0, 'statements': Counter()}
+        g.query_stats['count'] += 1
+        g.query_stats['time'] += time.time() - start
+        g.query_stats['statements'][statement] += 1
+
+    def check_budget(self, response):
+        """Report requests over budget and possible N+1 queries."""
+        stats = g.get('query_stats')
+        if stats is None:
+            stats = {'count': 0, 'time': 0, 'statements': Counter()}
+        if self.app.debug:
+            response.headers['X-Query-Count'] = str(stats['count'])
+            response.headers['X-Query-Time'] = '{:.1f}ms'.format(
+                stats['time'] * 1000
+            )
+
+        limit = self.app.config['QUERY_REPEAT_LIMIT']
+        for statement, count in stats['statements'].items():
+            if count > limit:
+                self.app.logger.warning(
+                    "Possible N+1: statement run {} times: {}".format(
+                        count, statement[:200]
+                    )
+                )
+
+        budget = g.get('query_budget')
+        if budget is not None and stats['count'] > budget:
+            message = "{} ran {} SQL queries, budget is {}.".format(
+                request.endpoint,
+                stats['count'],
+                budget
+            )
+            if self.app.config['QUERY_BUDGET_RAISE']:
+                raise QueryBudgetExceeded(message)
+            self.app.logger.warning(message)
+        return response
+
+
+query_counter = QueryCounter()
@@ -0,0 +1,439 @@
+"""
+Server side sessions and cache of logged in users.
+
+By default Flask keeps sessions in a signed cookie and flask-login loads
+the user from flask_user on every request. Here sessions and a snapshot of
+logged in users can be kept in a pluggable store instead:
+- memory: per process, for dev only since uwsgi workers do not share it
+- filesystem: shared by all the workers of a node
+- shared: a redis-like server (anything with get/setex/delete/incr/expire
+and rpush/blpop), with an in-process fake when no server is configured
+"""
+
+import hashlib
+import os
+import queue
+import secrets
+import tempfile
+import threading
+import time
+
+from flask.sessions import (
+    SessionInterface,
+    SessionMixin,
+    session_json_serializer
+)
+from werkzeug.datastructures import CallbackDict
+
+
+class MemoryStore(object):
+    """Keys with a TTL in a dict of the current process."""
+
+    def __init__(self):
+        """Values are stored with their expiration timestamp."""
+        self.data = {}
+        self.queues = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return value or None if missing or expired."""
+        value, expires = self.data.get(key, (None, 0))
+        if expires < time.time():
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        """Store value for ttl seconds."""
+        with self.lock:
+            self.data[key] = (value, time.time() + ttl)
+            # Cheap purge of expired keys so the dict does not grow forever
+            if len(self.data) % 1000 == 0:
+                now = time.time()
+                self.data = {
+                    k: v for k, v in self.data.items() if v[1] >= now
+                }
+
+    def add(self, key, value, ttl):
+        """Store value for ttl seconds only if key is missing or expired."""
+        with self.lock:
+            if self.data.get(key, (None, 0))[1] >= time.time():
+                return False
+            self.data[key] = (value, time.time() + ttl)
+            return True
+
+    def delete(self, key):
+        """Remove key if present."""
+        with self.lock:
+            self.data.pop(key, None)
+
+    def incr(self, key, ttl):
+        """Increment counter, created with ttl seconds to live."""
+        with self.lock:
+            now = time.time()
+            value, expires = self.data.get(key, (0, 0))
+            if expires < now:
+                value, expires = 0, now + ttl
+            self.data[key] = (value + 1, expires)
+            return value + 1
+
+    def push(self, key, value):
+        """Append value to the queue named key."""
+        with self.lock:
+            queue_ = self.queues.setdefault(key, queue.Queue())
+        queue_.put(value)
+
+    def pop(self, key, timeout):
+        """Pop first value of queue named key, None after timeout seconds."""
+        with self.lock:
+            queue_ = self.queues.setdefault(key, queue.Queue())
+        try:
+            return queue_.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def length(self, key):
+        """Number of values in queue named key."""
+        queue_ = self.queues.get(key)
+        return queue_.qsize() if queue_ is not None else 0
+
+
+class FileSystemStore(object):
+    """One file per key, expiration timestamp on the first line."""
+
+    # Expired files are purged every PURGE_EVERY writes of a process
+    PURGE_EVERY = 1000
+
+    def __init__(self, path):
+        """Create store folder if needed."""
+        self.path = path
+        self.writes = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        """Get file path of key."""
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, name)
+
+    def get(self, key):
+        """Return value or None if missing or expired."""
+        try:
+            with open(self._file(key), 'r') as f:
+                expires = float(f.readline())
+                if expires < time.time():
+                    return None
+                return f.read()
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, value, ttl):
+        """Store value for ttl seconds, atomically."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, 'w') as f:
+            f.write('{}\n{}'.format(time.time() + ttl, value))
+        os.replace(tmp_path, self._file(key))
+        self.count_write()
+
+    def count_write(self):
+        """Purge expired files from time to time."""
+        self.writes += 1
+        if self.writes % self.PURGE_EVERY == 0:
+            self.purge()
+
+    def purge(self):
+        """Delete expired files. Return how many were deleted."""
+        now = time.time()
+        deleted = 0
+        for entry in os.scandir(self.path):
+            # Skip temporary files being written
+            if len(entry.name) != 40:
+                continue
+            try:
+                with open(entry.path, 'r') as f:
+                    expired = float(f.readline()) < now
+                if expired:
+                    os.remove(entry.path)
+                    deleted += 1
+            except (OSError, ValueError):
+                continue
+        return deleted
+
+    def add(self, key, value, ttl):
+        """
+        Store value for ttl seconds only if key is missing or expired.
+
+        Atomic across processes: the file is written aside, then hard
+        linked to its key, which fails if the key exists. An expired file
+        is removed first, so it is only racy when several processes take
+        over the same expired key at once.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, 'w') as f:
+            f.write('{}\n{}'.format(time.time() + ttl, value))
+        try:
+            for _ in range(2):
+                try:
+                    os.link(tmp_path, self._file(key))
+                    self.count_write()
+                    return True
+                except FileExistsError:
+                    if self.get(key) is not None:
+                        return False
+                    self.delete(key)
+            return False
+        finally:
+            os.remove(tmp_path)
+
+    def delete(self, key):
+        """Remove key if present."""
+        try:
+            os.remove(self._file(key))
+        except FileNotFoundError:
+            pass
+
+    def incr(self, key, ttl):
+        """
+        Increment counter, created with ttl seconds to live.
+
+        Not atomic across processes, which is good enough for throttling.
+        """
+        value = int(self.get(key) or 0) + 1
+        self.set(key, value, ttl)
+        return value
+
+
+class LocalSharedClient(object):
+    """In-process stand-in for a redis client."""
+
+    def __init__(self):
+        """Backed by a MemoryStore."""
+        self.store = MemoryStore()
+
+    def get(self, key):
+        """Same as redis GET."""
+        return self.store.get(key)
+
+    def setex(self, key, ttl, value):
+        """Same as redis SETEX."""
+        self.store.set(key, value, ttl)
+
+    def set(self, key, value, ex, nx):
+        """Same as redis SET with EX and NX."""
+        return self.store.add(key, value, ex) or None
+
+    def delete(self, *keys):
+        """Same as redis DEL."""
+        for key in keys:
+            self.store.delete(key)
+
+    def incr(self, key):
+        """Same as redis INCR, expiration is set by expire."""
+        return self.store.incr(key, float('inf'))
+
+    def expire(self, key, ttl):
+        """Same as redis EXPIRE."""
+        value = self.store.get(key)
+        if value is not None:
+            self.store.set(key, value, ttl)
+
+    def rpush(self, key, value):
+        """Same as redis RPUSH."""
+        self.store.push(key, value)
+
+    def blpop(self, key, timeout):
+        """Same as redis BLPOP."""
+        value = self.store.pop(key, timeout)
+        return None if value is None else (key, value)
+
+    def llen(self, key):
+        """Same as redis LLEN."""
+        return self.store.length(key)
+
+
+class SharedStore(object):
+    """Keys stored in a redis-like server shared by all nodes."""
+
+    def __init__(self, client):
+        """Client must provide the redis-py methods used below."""
+        self.client = client
+
+    def get(self, key):
+        """Return value or None if missing or expired."""
+        value = self.client.get(key)
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return value
+
+    def set(self, key, value, ttl):
+        """Store value for ttl seconds."""
+        self.client.setex(key, int(ttl), value)
+
+    def add(self, key, value, ttl):
+        """Store value for ttl seconds only if key is missing or expired."""
+        return bool(self.client.set(key, value, ex=int(ttl), nx=True))
+
+    def delete(self, key):
+        """Remove key if present."""
+        self.client.delete(key)
+
+    def incr(self, key, ttl):
+        """Increment counter, created with ttl seconds to live."""
+        value = self.client.incr(key)
+        if value == 1:
+            self.client.expire(key, int(ttl))
+        return value
+
+    def push(self, key, value):
+        """Append value to the list named key."""
+        self.client.rpush(key, value)
+
+    def pop(self, key, timeout):
+        """Pop first value of list named key, None after timeout seconds."""
+        item = self.client.blpop(key, timeout)
+        if item is None:
+            return None
+        value = item[1]
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return value
+
+    def length(self, key):
+        """Number of values in list named key."""
+        return self.client.llen(key)
+
+
+def make_store(app):
+    """Create store configured by SESSION_STORE, None for cookies."""
+    kind = app.config['SESSION_STORE']
+    if kind == 'memory':
+        return MemoryStore()
+    if kind == 'filesystem':
+        return FileSystemStore(app.config['SESSION_FILE_PATH'])
+    if kind == 'shared':
+        if app.config['SESSION_SHARED_URL']:
+            import redis
+            client = redis.Redis.from_url(app.config['SESSION_SHARED_URL'])
+        else:
+            app.logger.warning("No SESSION_SHARED_URL, using a local fake.")
+            client = LocalSharedClient()
+        return SharedStore(client)
+    return None
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session whose data is in a store, only its id is in the cookie."""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        """Flag session as modified whenever it is updated."""
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # User logged in when session was loaded, see save_session
+        self.loaded_user_id = self.get('_user_id')
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Load and save sessions from a store."""
+
+    def __init__(self, store):
+        """Use store for session data."""
+        self.store = store
+
+    def open_session(self, app, request):
+        """Load session from store, or start a new one."""
+        sid = request.cookies.get(app.config['SESSION_COOKIE_NAME'])
+        if sid:
+            data = self.store.get('session:' + sid)
+            if data is not None:
+                return ServerSideSession(
+                    session_json_serializer.loads(data),
+                    sid=sid
+                )
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        """
+        Write session to store only if it changed.
+
+        A new session id is issued when the user logs in or out, so that
+        an id planted before login (session fixation) is worthless.
+        """
+        name = app.config['SESSION_COOKIE_NAME']
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified:
+                self.store.delete('session:' + session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if session.get('_user_id') != session.loaded_user_id:
+            self.store.delete('session:' + session.sid)
+            session.sid = secrets.token_urlsafe(32)
+            session.loaded_user_id = session.get('_user_id')
+        elif not self.should_set_cookie(app, session):
+            return
+        self.store.set(
+            'session:' + session.sid,
+            session_json_serializer.dumps(dict(session)),
+            app.permanent_session_lifetime.total_seconds()
+        )
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app)
+        )
+
+
+class UserCache(object):
+    """
+    Cache of user columns.
+
+    Loading a logged in user then does not query flask_user on every
+    page view.
+    """
+
+    def __init__(self):
+        """Store is set by init_app."""
+        self.store = MemoryStore()
+        self.ttl = 300
+
+    def init_app(self, app, store=None):
+        """Use the session store if any, so that all workers share it."""
+        if store is not None:
+            self.store = store
+        self.ttl = app.config['USER_CACHE_TTL']
+
+    def get(self, user_id):
+        """Get cached columns of user, None if not cached."""
+        data = self.store.get('user:{}'.format(user_id))
+        if data is None:
+            return None
+        return session_json_serializer.loads(data)
+
+    def set(self, user_id, data):
+        """Cache columns of user."""
+        self.store.set(
+            'user:{}'.format(user_id),
+            session_json_serializer.dumps(data),
+            self.ttl
+        )
+
+    def delete(self, user_ids):
+        """Drop cached users."""
+        for user_id in user_ids:
+            self.store.delete('user:{}'.format(user_id))
+
+
+def init_sessions(app, user_cache):
+    """Switch to server side sessions if configured and set user cache."""
+    store = make_store(app)
+    if store is not None:
+        app.session_interface = ServerSideSessionInterface(store)
+    user_cache.init_app(app, store)
+    return store
@@ -10,6 +10,8 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_mail import Mail
 from flask_login import LoginManager
+from sessions import UserCache
+import atexit
 import logging
 from logging import StreamHandler
 from logging.handlers import RotatingFileHandler
@@ -29,6 +31,9 @@ mail = Mail()
 # Init flask_login which handles user login
 login_manager = LoginManager()
 
+# Cache of logged in users, avoids a db query on every page view
+user_cache = UserCache()
+
 # Set logging
 if app.config['LOG_FILE_PATH']:
     loggingHandler = RotatingFileHandler(
@@ -43,3 +48,49 @@ if app.config['DEBUG']:
 else:
     loggingHandler.setLevel(logging.WARNING)
 app.logger.addHandler(loggingHandler)
+
+
+def on_worker_exit(func):
+    """
+    Call func when the process stops.
+
+    uwsgi workers do not run Python atexit handlers, uwsgi has its own
+    single hook so handlers are chained.
+    """
+    atexit.register(func)
+    try:
+        import uwsgi
+    except ImportError:
+        return
+    previous = getattr(uwsgi, 'atexit', None)
+
+    def chained():
+        func()
+        if previous:
+            previous()
+    uwsgi.atexit = chained
+
+
+def on_worker_start(func):
+    """
+    Call func in every process that serves requests.
+
+    uwsgi loads the app in its master then forks workers, and threads
+    started before the fork do not run in them: func is then called by
+    uwsgi's post fork hook instead, chained like atexit.
+    """
+    try:
+        import uwsgi
+    except ImportError:
+        func()
+        return
+    if uwsgi.worker_id() > 0:
+        # No master, or app loaded by each worker (lazy-apps)
+        func()
+    previous = getattr(uwsgi, 'post_fork_hook', None)
+
+    def chained():
+        func()
+        if previous:
+            previous()
+    uwsgi.post_fork_hook = chained
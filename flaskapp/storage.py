@@ -0,0 +1,267 @@
+"""
+Storage of user files.
+
+Backend is chosen by STORAGE_BACKEND:
+- local: folders under USER_FOLDERS_PATH. Fine for a single node, or for
+several nodes sharing the same mount (NFS...)
+- s3: objects in the STORAGE_S3_BUCKET bucket (needs boto3), shared by all
+nodes
+- memory: in-process stand-in, for tests
+"""
+
+import io
+import os
+import pathlib
+import shutil
+import tempfile
+
+
+class LocalBackend(object):
+    """User files in folders named after user ids."""
+
+    def __init__(self, root):
+        """Folders are created under root."""
+        self.root = root
+
+    def makedirs(self, path):
+        """Create folder and its parents."""
+        pathlib.Path(os.path.join(self.root, path)).mkdir(
+            parents=True,
+            exist_ok=True
+        )
+
+    def save(self, path, stream):
+        """Write stream to path, atomically."""
+        full_path = os.path.join(self.root, path)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(full_path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(stream, f, 1024 * 1024)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def open(self, path, start=0):
+        """Open file for reading from byte start."""
+        f = open(os.path.join(self.root, path), 'rb')
+        f.seek(start)
+        return f
+
+    def rename(self, path, new_path):
+        """Move file, atomically."""
+        os.replace(
+            os.path.join(self.root, path),
+            os.path.join(self.root, new_path)
+        )
+
+    def delete(self, path):
+        """Remove file if present."""
+        try:
+            os.remove(os.path.join(self.root, path))
+        except FileNotFoundError:
+            pass
+
+    def move_folder(self, path, new_path):
+        """Move folder unless new_path exists. Return True if moved."""
+        full_path = os.path.join(self.root, path)
+        new_full_path = os.path.join(self.root, new_path)
+        if not os.path.isdir(full_path) or os.path.exists(new_full_path):
+            return False
+        os.rename(full_path, new_full_path)
+        return True
+
+    def local_path(self, path):
+        """Path of file on this host."""
+        return os.path.join(self.root, path)
+
+
+class S3Backend(object):
+    """User files as objects of a S3 bucket."""
+
+    def __init__(self, bucket, prefix):
+        """Objects keys are prefixed with prefix."""
+        import boto3
+        self.client = boto3.client('s3')
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def makedirs(self, path):
+        """Folders do not exist in S3."""
+        pass
+
+    def save(self, path, stream):
+        """Upload stream, in parts if it is big."""
+        self.client.upload_fileobj(stream, self.bucket, self.prefix + path)
+
+    def open(self, path, start=0):
+        """Open object for reading from byte start."""
+        kwargs = {'Range': 'bytes={}-'.format(start)} if start else {}
+        try:
+            response = self.client.get_object(
+                Bucket=self.bucket,
+                Key=self.prefix + path,
+                **kwargs
+            )
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(path)
+        return response['Body']
+
+    def rename(self, path, new_path):
+        """Copy object to new key, then delete it."""
+        self.client.copy(
+            {'Bucket': self.bucket, 'Key': self.prefix + path},
+            self.bucket,
+            self.prefix + new_path
+        )
+        self.delete(path)
+
+    def delete(self, path):
+        """Delete object, no error if missing."""
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + path)
+
+    def keys(self, path):
+        """Keys of the objects under folder path, without prefix."""
+        paginator = self.client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(
+            Bucket=self.bucket,
+            Prefix=self.prefix + path + '/'
+        )
+        for page in pages:
+            for item in page.get('Contents', []):
+                yield item['Key'][len(self.prefix):]
+
+    def move_folder(self, path, new_path):
+        """
+        Move objects under path unless new_path has some.
+
+        Return True if moved. Objects are moved one by one, so running it
+        again finishes an interrupted move.
+        """
+        if next(self.keys(new_path), None) is not None:
+            return False
+        moved = False
+        for key in list(self.keys(path)):
+            self.rename(key, new_path + key[len(path):])
+            moved = True
+        return moved
+
+    def local_path(self, path):
+        """Objects are not on this host."""
+        return None
+
+
+class MemoryBackend(object):
+    """User files in a dict of the current process."""
+
+    def __init__(self):
+        """Files are kept in self.files."""
+        self.files = {}
+
+    def makedirs(self, path):
+        """No folders in memory."""
+        pass
+
+    def save(self, path, stream):
+        """Keep content of stream."""
+        self.files[path] = stream.read()
+
+    def open(self, path, start=0):
+        """Open content for reading from byte start."""
+        if path not in self.files:
+            raise FileNotFoundError(path)
+        return io.BytesIO(self.files[path][start:])
+
+    def rename(self, path, new_path):
+        """Move content to new path."""
+        self.files[new_path] = self.files.pop(path)
+
+    def delete(self, path):
+        """Forget content if present."""
+        self.files.pop(path, None)
+
+    def move_folder(self, path, new_path):
+        """Move contents under path unless new_path has some."""
+        if any(key.startswith(new_path + '/') for key in self.files):
+            return False
+        keys = [key for key in self.files if key.startswith(path + '/')]
+        for key in keys:
+            self.rename(key, new_path + key[len(path):])
+        return bool(keys)
+
+    def local_path(self, path):
+        """Content is not in a file."""
+        return None
+
+
+class UserStorage(object):
+    """Files of users, whatever the backend."""
+
+    def __init__(self):
+        """Backend is set by init_app."""
+        self.backend = None
+
+    def init_app(self, app):
+        """Create backend configured by STORAGE_BACKEND."""
+        kind = app.config['STORAGE_BACKEND']
+        if kind == 's3':
+            self.backend = S3Backend(
+                app.config['STORAGE_S3_BUCKET'],
+                app.config['STORAGE_S3_PREFIX']
+            )
+        elif kind == 'memory':
+            self.backend = MemoryBackend()
+        else:
+            self.backend = LocalBackend(app.config['USER_FOLDERS_PATH'])
+
+    def create_user_folders(self, user):
+        """Create data and model folders of user."""
+        self.makedirs(user, 'data')
+        self.makedirs(user, 'model')
+
+    def makedirs(self, user, path):
+        """Create folder, relative to user folder."""
+        self.backend.makedirs('{}/{}'.format(user.id, path))
+
+    def save(self, user, path, file_storage):
+        """Save an uploaded file to path, relative to user folder."""
+        self.save_stream(user, path, file_storage.stream)
+
+    def save_stream(self, user, path, stream):
+        """Save a binary stream to path, relative to user folder."""
+        self.backend.save('{}/{}'.format(user.id, path), stream)
+
+    def open(self, user, path, start=0):
+        """
+        Open a file of user for reading from byte start.
+
+        Raise FileNotFoundError if missing, whatever the backend.
+        """
+        return self.backend.open('{}/{}'.format(user.id, path), start)
+
+    def rename(self, user, path, new_path):
+        """Move a file of user."""
+        self.backend.rename(
+            '{}/{}'.format(user.id, path),
+            '{}/{}'.format(user.id, new_path)
+        )
+
+    def delete(self, user, path):
+        """Remove a file of user if present."""
+        self.backend.delete('{}/{}'.format(user.id, path))
+
+    def move_legacy_folder(self, user):
+        """
+        Move folder named after user email to the one named after its id.
+
+        Return True if moved, False if there was nothing to move or the
+        new folder already exists.
+        """
+        return self.backend.move_folder(user.email, str(user.id))
+
+    def local_path(self, user, path):
+        """Path of a file of user on this host, None if not local."""
+        return self.backend.local_path('{}/{}'.format(user.id, path))
+
+
+storage = UserStorage()
@@ -0,0 +1,121 @@
+"""
+Fixtures of the test suite.
+
+Run from the flaskapp folder: python -m pytest tests
+Tests do not need a database server: views that query it are either not
+called or run on an in-memory SQLite database (see test_query_budget.py).
+"""
+
+from datetime import datetime
+import os
+import sys
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.schema import CreateTable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskapp import app as flask_app  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """Flask app in testing mode."""
+    flask_app.config['TESTING'] = True
+    flask_app.config['SECRET_KEY'] = 'test'
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    """Test client of app."""
+    return app.test_client()
+
+
+@pytest.fixture
+def cli(app, monkeypatch):
+    """CLI runner of app, restoring the debug flag the CLI resets."""
+    monkeypatch.setattr(app, 'debug', app.debug)
+    return app.test_cli_runner()
+
+
+@pytest.fixture
+def user(monkeypatch):
+    """Premium user authenticated by any X-API-KEY, without database."""
+    from apis.usage import UsageRecorder
+    from user_account.models import User
+
+    user = User(
+        id=1,
+        email='user@example.com',
+        is_premium=True,
+        is_admin=False,
+        token_version=0
+    )
+    monkeypatch.setattr(
+        User,
+        'verify_auth_token',
+        staticmethod(lambda token: user)
+    )
+    # Usage would be flushed to the database
+    monkeypatch.setattr(UsageRecorder, 'record', lambda self, *args: None)
+    return user
+
+
+@pytest.fixture
+def files(monkeypatch):
+    """User files kept in memory."""
+    from storage import MemoryBackend, storage
+
+    backend = MemoryBackend()
+    monkeypatch.setattr(storage, 'backend', backend)
+    return backend.files
+
+
+@pytest.fixture
+def database(app, monkeypatch):
+    """
+    In-memory SQLite database holding flask_user, return API token.
+
+    Holds User@example.com, password "secret". Queries go through
+    SQLAlchemy engine events like on PostgreSQL, so they count against
+    budgets. Indexes are PostgreSQL specific and left out.
+    """
+    from apis.usage import UsageRecorder
+    from datasets import datasets
+    from sessions import MemoryStore
+    from setup import db, user_cache
+    from user_account.models import User
+    from user_account.throttle import throttle
+
+    engine = sa.create_engine(
+        'sqlite://',
+        connect_args={'check_same_thread': False},
+        poolclass=StaticPool
+    )
+    engine.execute(CreateTable(User.__table__))
+    monkeypatch.setattr(db, 'get_engine', lambda *args, **kwargs: engine)
+    monkeypatch.setitem(app.config, 'QUERY_BUDGET_RAISE', True)
+    monkeypatch.setattr(user_cache, 'store', MemoryStore())
+    monkeypatch.setattr(throttle, 'store', MemoryStore())
+    monkeypatch.setattr(datasets, 'store', MemoryStore())
+    # Usage would be flushed to the database
+    monkeypatch.setattr(UsageRecorder, 'record', lambda self, *args: None)
+    db.session.remove()
+
+    with app.app_context():
+        user = User(
+            email='User@example.com',
+            is_premium=True,
+            confirmed=True,
+            registered_on=datetime(2026, 1, 1)
+        )
+        user.set_password('secret')
+        db.session.add(user)
+        db.session.commit()
+        token = user.generate_auth_token().decode('ascii')
+        db.session.remove()
+    yield token
+    db.session.remove()
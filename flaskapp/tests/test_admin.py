@@ -0,0 +1,90 @@
+"""User administration API."""
+
+import importlib
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+# apis.ns3 is shadowed by the namespace object of the same name
+ns3 = importlib.import_module('apis.ns3')
+
+API_KEY = {'X-API-KEY': 'token'}
+
+
+class FakeSession(object):
+    """Database session inserting users with ids from 1."""
+
+    def execute(self, statement):
+        """Pretend every row of the INSERT was created."""
+        rows = statement.compile(dialect=postgresql.dialect()).params
+        emails = [v for k, v in sorted(rows.items()) if k.startswith('email')]
+        return FakeResult(list(enumerate(emails, 1)))
+
+    def commit(self):
+        """Nothing to commit."""
+
+    def remove(self):
+        """Nothing to close."""
+
+
+class FakeResult(object):
+    """Rows returned by an INSERT."""
+
+    def __init__(self, rows):
+        """Keep rows."""
+        self.rows = rows
+
+    def fetchall(self):
+        """Rows."""
+        return self.rows
+
+
+@pytest.fixture
+def admin(user):
+    """Authenticated user is an admin."""
+    user.is_admin = True
+    return user
+
+
+def test_bulk_create_validates_payload(client):
+    """Malformed payloads get a 400, before any user is created."""
+    for payload in [
+        {},
+        {'users': [{}]},
+        {'users': 'a@example.com'},
+        {'users': [{'email': 'not an email'}]},
+        {'users': [{'email': 'a@example.com', 'first_name': 'x' * 51}]},
+        {'users': [{'email': 'a' * 120 + '@example.com'}]},
+    ]:
+        response = client.post('/api/admin/users', json=payload)
+        assert response.status_code == 400
+
+
+def test_premium_update_validates_payload(client):
+    """A list of emails is required."""
+    response = client.post('/api/admin/users/upgrade', json={})
+    assert response.status_code == 400
+
+
+def test_bulk_create_reports_failed_emails(client, admin, files, monkeypatch):
+    """Users whose email could not be sent are reported, others set up."""
+    sent = []
+
+    def send_pwd_reset_email(email):
+        if email == 'b@example.com':
+            raise ConnectionRefusedError("SMTP server down")
+        sent.append(email)
+
+    monkeypatch.setattr(ns3.db, 'session', FakeSession())
+    monkeypatch.setattr(ns3, 'send_pwd_reset_email', send_pwd_reset_email)
+    emails = ['a@example.com', 'b@example.com', 'c@example.com']
+
+    response = client.post(
+        '/api/admin/users',
+        json={'users': [{'email': email} for email in emails]},
+        headers=API_KEY
+    )
+
+    assert response.status_code == 201
+    assert response.get_json()['failed'] == ['b@example.com']
+    assert sent == ['a@example.com', 'c@example.com']
@@ -0,0 +1,70 @@
+"""API tokens and lookups of users."""
+
+from itsdangerous import JSONWebSignatureSerializer as Serializer
+
+from setup import db
+from user_account.models import User
+
+
+def test_token_follows_secret_key(app, monkeypatch):
+    """Tokens signed with a rotated key are not served from cache."""
+    user = User(id=1, token_version=0)
+    with app.app_context():
+        monkeypatch.setitem(app.config, 'SECRET_KEY', 'old')
+        old = user.generate_auth_token()
+        monkeypatch.setitem(app.config, 'SECRET_KEY', 'new')
+        new = user.generate_auth_token()
+
+    assert old != new
+
+
+def test_revoked_token_is_not_shown_nor_accepted(app, client, database):
+    """Revoking drops the cached user, pages show the new token."""
+    client.post(
+        '/home/login',
+        data={'email': 'user@example.com', 'password': 'secret'}
+    )
+    assert database.encode('ascii') in client.get('/home/').data
+
+    with app.app_context():
+        user = User.get_by_email('user@example.com')
+        user.revoke_auth_token()
+        new = user.generate_auth_token()
+        db.session.remove()
+
+    page = client.get('/home/').data
+    assert database.encode('ascii') not in page
+    assert new in page
+    with app.app_context():
+        assert User.verify_auth_token(database) is None
+        assert User.verify_auth_token(new).email == 'User@example.com'
+
+
+def test_email_lookup_ignores_case(app, database):
+    """Emails are unique case insensitively."""
+    with app.app_context():
+        for email in ('user@example.com', 'USER@EXAMPLE.COM'):
+            assert User.get_by_email(email).email == 'User@example.com'
+        assert User.get_by_email('other@example.com') is None
+
+
+def test_legacy_email_token_is_accepted(app, database):
+    """Tokens issued before integer ids hold an email, in any case."""
+    with app.app_context():
+        legacy = Serializer(app.config['SECRET_KEY']).dumps(
+            {'email': 'user@example.com'}
+        )
+        assert User.verify_auth_token(legacy).email == 'User@example.com'
+
+        User.get_by_email('user@example.com').revoke_auth_token()
+        assert User.verify_auth_token(legacy) is None
+
+
+def test_move_user_folders(cli, database, files):
+    """The CLI moves folders named after emails through the storage."""
+    files['User@example.com/data/a.csv'] = b'a'
+
+    result = cli.invoke(args=['move-user-folders'])
+
+    assert result.output == "1 user folders moved.\n"
+    assert files == {'1/data/a.csv': b'a'}
@@ -0,0 +1,17 @@
+"""Response compression."""
+
+
+def test_vary_even_if_not_compressed(client):
+    """Compressible responses vary on Accept-Encoding, compressed or not."""
+    plain = client.get('/home/login')
+    compressed = client.get('/home/login', headers={'Accept-Encoding': 'gzip'})
+    not_modified = client.get(
+        '/home/login',
+        headers={'If-None-Match': plain.headers['ETag']}
+    )
+
+    assert 'Content-Encoding' not in plain.headers
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    for response in (plain, compressed, not_modified):
+        assert 'Accept-Encoding' in response.headers['Vary']
+    assert not_modified.status_code == 304
@@ -0,0 +1,137 @@
+"""Versioned datasets."""
+
+import io
+from datetime import datetime, timedelta
+
+import pytest
+
+from datasets import DatasetBusy, datasets
+from sessions import MemoryStore
+
+API_KEY = {'X-API-KEY': 'token'}
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch):
+    """Locks kept in a fresh store."""
+    store = MemoryStore()
+    monkeypatch.setattr(datasets, 'store', store)
+    return store
+
+
+def upload(client, data):
+    """Upload data as a new version of the build dataset."""
+    return client.post(
+        '/api/build/1_upload',
+        data={'file': (io.BytesIO(data), 'data.csv')},
+        headers=API_KEY
+    )
+
+
+def download(client, number, **headers):
+    """GET a version of the build dataset."""
+    return client.get(
+        '/api/datasets/build/{}'.format(number),
+        headers=dict(API_KEY, **headers),
+        buffered=True
+    )
+
+
+def test_uploads_are_versioned(client, user, files):
+    """Each upload is a new version, listed in the manifest."""
+    assert upload(client, b'a,b\n1,2\n').status_code == 200
+    assert upload(client, b'a,b\n3,4\n5,6').status_code == 200
+
+    versions = client.get('/api/datasets/build', headers=API_KEY).get_json()
+    assert [(v['version'], v['rows']) for v in versions] == [(1, 2), (2, 3)]
+    assert download(client, 1).data == b'a,b\n1,2\n'
+    assert download(client, 2).data == b'a,b\n3,4\n5,6'
+
+
+def test_retention_drops_old_versions(app, client, user, files, monkeypatch):
+    """Only DATASET_KEEP_VERSIONS versions are kept, files included."""
+    monkeypatch.setitem(app.config, 'DATASET_KEEP_VERSIONS', 2)
+    for i in range(3):
+        upload(client, 'v{}\n'.format(i).encode())
+
+    versions = datasets.versions(user, 'build')
+    assert [v['version'] for v in versions] == [2, 3]
+    assert '1/data/build/v000001.csv' not in files
+    assert download(client, 1).status_code == 404
+
+
+def test_gc_drops_expired_versions(app, user, files, monkeypatch):
+    """gc drops versions older than DATASET_KEEP_SECONDS but the latest."""
+    monkeypatch.setitem(app.config, 'DATASET_KEEP_SECONDS', 3600)
+    for i in range(3):
+        datasets.add(user, 'build', io.BytesIO(b'x'))
+    versions = datasets.versions(user, 'build')
+    old = (datetime.utcnow() - timedelta(hours=2)).isoformat()
+    for entry in versions:
+        entry['created_at'] = old
+    datasets.write_versions(user, 'build', versions)
+
+    assert datasets.gc(user, 'build') == 2
+    assert [v['version'] for v in datasets.versions(user, 'build')] == [3]
+    assert sorted(files) == [
+        '1/data/build/manifest.json',
+        '1/data/build/v000003.csv',
+    ]
+
+
+def test_lock_serializes_uploads(app, client, user, files, store,
+                                 monkeypatch):
+    """An upload waits for the lock of its dataset, then gives up."""
+    monkeypatch.setitem(app.config, 'DATASET_LOCK_WAIT', 0)
+    key = datasets.lock(user, 'build')
+    with pytest.raises(DatasetBusy):
+        datasets.lock(user, 'build')
+    assert upload(client, b'x').status_code == 409
+    assert not [f for f in files if f.endswith('.tmp')]
+
+    store.delete(key)
+    assert upload(client, b'x').status_code == 200
+
+
+def test_ranges(client, user, files):
+    """Single byte ranges get a 206, unsatisfiable ones a 416."""
+    upload(client, b'0123456789')
+
+    response = download(client, 1, Range='bytes=4-')
+    assert response.status_code == 206
+    assert response.data == b'456789'
+    assert response.headers['Content-Range'] == 'bytes 4-9/10'
+
+    response = download(client, 1, Range='bytes=20-')
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */10'
+
+
+def test_not_modified(client, user, files):
+    """A client revalidating with the ETag it got gets a 304."""
+    upload(client, b'0123456789')
+    etag = download(client, 1).headers['ETag']
+
+    assert download(client, 1, **{'If-None-Match': etag}).status_code == 304
+    weak = 'W/' + etag
+    assert download(client, 1, **{'If-None-Match': weak}).status_code == 304
+
+
+def test_resume_with_gzip_client(client, user, files):
+    """Downloads stay identity encoded, so that ranges can resume them."""
+    data = b'a,b\n' + b'1,2\n' * 1000
+    upload(client, data)
+    headers = {'Accept-Encoding': 'gzip'}
+
+    first = download(client, 1, **headers)
+    assert 'Content-Encoding' not in first.headers
+    assert first.headers['Accept-Ranges'] == 'bytes'
+    assert first.data == data
+
+    resumed = download(client, 1, Range='bytes=100-', **headers)
+    assert resumed.status_code == 206
+    assert first.data[:100] + resumed.data == data
+    not_modified = download(
+        client, 1, **dict(headers, **{'If-None-Match': first.headers['ETag']})
+    )
+    assert not_modified.status_code == 304
@@ -0,0 +1,121 @@
+"""Health checks and admission control under simulated overload."""
+
+import time
+
+from flask import g
+import pytest
+
+import health
+from health import admission
+
+
+class Clock(object):
+    """Stand-in for the time module, moved forward by hand."""
+
+    def __init__(self):
+        """Start now."""
+        self.now = time.time()
+
+    def time(self):
+        """Current fake time."""
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake clock of the admission controller, with no latency yet."""
+    clock = Clock()
+    monkeypatch.setattr(health, 'time', clock)
+    monkeypatch.setattr(admission, 'latency', 0.0)
+    monkeypatch.setattr(admission, 'updated', clock.now)
+    return clock
+
+
+def finish_request(app, path, seconds, long_request=False):
+    """Feed the latency of a request to the admission controller."""
+    with app.test_request_context(path):
+        g.admission_start = health.time.time() - seconds
+        if long_request:
+            g.admission_long_request = True
+        admission.release(None)
+
+
+def overload(app, pressure):
+    """Simulate recent requests taking pressure times the target."""
+    target = app.config['ADMISSION_TARGET_LATENCY']
+    for _ in range(100):
+        finish_request(app, '/home/login', pressure * target)
+
+
+def test_healthz(client):
+    """Liveness answers."""
+    assert client.get('/healthz').status_code == 200
+
+
+def test_admits_without_load(client, clock):
+    """No request is shed when latency is low."""
+    assert client.get('/home/login').status_code == 200
+    assert client.get('/api/usage/').status_code == 401
+
+
+def test_sheds_low_priority_first(app, client, clock):
+    """HTML pages and Swagger are shed before API calls."""
+    overload(app, 1.5)
+
+    response = client.get('/home/login')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(
+        app.config['ADMISSION_RETRY_AFTER']
+    )
+    assert client.get('/api/swagger.json').status_code == 503
+    assert client.get('/api/usage/').status_code == 401
+    assert client.get('/healthz').status_code == 200
+
+
+def test_sheds_api_under_heavy_load(app, client, clock):
+    """API calls are shed past ADMISSION_HIGH_PRIORITY_PRESSURE."""
+    overload(app, app.config['ADMISSION_HIGH_PRIORITY_PRESSURE'] + 1)
+
+    assert client.get('/api/usage/').status_code == 503
+    assert client.get('/healthz').status_code == 200
+
+
+def test_sheds_on_queue_time(app, client, clock):
+    """Requests that waited long before reaching the worker are shed."""
+    waited = 1.5 * app.config['ADMISSION_TARGET_QUEUE_TIME']
+    headers = {'X-Request-Start': 't={:.3f}'.format(clock.now - waited)}
+
+    assert client.get('/home/login', headers=headers).status_code == 503
+    assert client.get('/api/usage/', headers=headers).status_code == 401
+
+
+def test_recovers_once_load_drops(app, client, clock):
+    """Latency average decays even if every request is shed meanwhile."""
+    finish_request(app, '/home/login', 60)
+    assert client.get('/home/login').status_code == 503
+    assert client.get('/api/usage/').status_code == 503
+
+    clock.now += 10 * app.config['ADMISSION_LATENCY_HALF_LIFE']
+    assert client.get('/api/usage/').status_code == 401
+    assert client.get('/home/login').status_code == 200
+
+
+def test_long_requests_not_counted(app, client, clock):
+    """A slow upload does not make the worker look overloaded."""
+    finish_request(app, '/api/build/1_upload', 60, long_request=True)
+
+    assert client.get('/home/login').status_code == 200
+
+
+def test_shed_requests_are_not_all_logged(app, client, clock, monkeypatch,
+                                          caplog):
+    """Overload does not fill the log."""
+    monkeypatch.setattr(admission, 'shed', 0)
+    overload(app, 1.5)
+    for _ in range(10):
+        assert client.get('/home/login').status_code == 503
+
+    assert admission.shed == 10
+    assert len([
+        r for r in caplog.records if 'Shedding' in r.getMessage()
+    ]) == 1
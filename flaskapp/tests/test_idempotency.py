@@ -0,0 +1,117 @@
+"""Idempotency-Key header of uploads."""
+
+import io
+import time
+
+import pytest
+
+from apis.idempotency import Idempotency, idempotency
+from datasets import datasets
+from sessions import MemoryStore
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch):
+    """Keys and dataset locks kept in a fresh store."""
+    store = MemoryStore()
+    monkeypatch.setattr(idempotency, 'store', store)
+    monkeypatch.setattr(datasets, 'store', store)
+    return store
+
+
+def upload(client, data=b'a,b\n1,2\n', key='key-1', filename='data.csv'):
+    """Upload data with an Idempotency-Key."""
+    return client.post(
+        '/api/build/1_upload',
+        data={'file': (io.BytesIO(data), filename)},
+        headers={'X-API-KEY': 'token', 'Idempotency-Key': key}
+    )
+
+
+def test_retry_gets_first_response(client, user, files):
+    """A retry is answered from the stored response, file not written."""
+    first = upload(client)
+    retry = upload(client)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.get_json() == first.get_json()
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert len(datasets.versions(user, 'build')) == 1
+
+
+def test_other_key_runs_again(client, user, files):
+    """Each key is a different request."""
+    upload(client, key='key-1')
+    upload(client, key='key-2')
+
+    assert len(datasets.versions(user, 'build')) == 2
+
+
+def test_key_reused_for_other_upload(client, user, files):
+    """Another body or file name under the same key gets a 422."""
+    assert upload(client).status_code == 200
+
+    assert upload(client, data=b'a,b\n1,2\n3,4\n').status_code == 422
+    assert upload(client, filename='other.csv').status_code == 422
+    assert len(datasets.versions(user, 'build')) == 1
+
+
+def test_duplicate_in_flight_gets_409(client, user, files, monkeypatch):
+    """A duplicate does not wait in the worker for the first attempt."""
+    duplicates = []
+    add = datasets.add
+
+    def add_with_duplicate(user, name, stream):
+        duplicates.append(upload(client))
+        return add(user, name, stream)
+    monkeypatch.setattr(datasets, 'add', add_with_duplicate)
+
+    assert upload(client).status_code == 200
+    assert duplicates[0].status_code == 409
+    assert duplicates[0].headers['Retry-After'] == '5'
+
+    monkeypatch.setattr(datasets, 'add', add)
+    assert upload(client).headers['Idempotent-Replayed'] == 'true'
+
+
+def failing_add(monkeypatch, error):
+    """Make the next upload raise error."""
+    add = datasets.add
+
+    def add_once(user, name, stream):
+        monkeypatch.setattr(datasets, 'add', add)
+        raise error
+    monkeypatch.setattr(datasets, 'add', add_once)
+
+
+def test_failed_attempt_can_be_retried(client, user, files, monkeypatch):
+    """Only successes are stored, the lock is released on failure."""
+    failing_add(monkeypatch, OSError('disk full'))
+    with pytest.raises(OSError):
+        upload(client)
+
+    response = upload(client)
+    assert response.status_code == 200
+    assert 'Idempotent-Replayed' not in response.headers
+
+
+def test_takes_over_after_lock_expires(app, client, user, files,
+                                       monkeypatch):
+    """The lock of a worker killed mid upload does not block the key."""
+    now = [time.time()]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    # Worker killed while uploading: lock never released
+    release = Idempotency.release
+    monkeypatch.setattr(Idempotency, 'release', lambda self, key: None)
+    failing_add(monkeypatch, SystemExit())
+    with pytest.raises(SystemExit):
+        upload(client)
+    monkeypatch.setattr(Idempotency, 'release', release)
+
+    assert upload(client).status_code == 409
+
+    now[0] += app.config['IDEMPOTENCY_LOCK_TTL'] + 1
+    response = upload(client)
+    assert response.status_code == 200
+    assert 'Idempotent-Replayed' not in response.headers
+    assert upload(client).headers['Idempotent-Replayed'] == 'true'
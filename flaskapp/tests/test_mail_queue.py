@@ -0,0 +1,160 @@
+"""Queue of emails."""
+
+from flask import Flask
+from flask_mail import Message
+import pytest
+
+import config
+import mail_queue as mail_queue_module
+from mail_queue import MailQueue
+from sessions import LocalSharedClient, SharedStore
+
+
+class FakeMail(object):
+    """flask_mail.Mail failing the first failures sends."""
+
+    def __init__(self, failures=0):
+        """Sent messages are kept in self.sent."""
+        self.default_sender = 'noreply@example.com'
+        self.failures = failures
+        self.sent = []
+
+    def send(self, msg):
+        """Record msg, or raise like a down SMTP server."""
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionRefusedError('SMTP server down')
+        self.sent.append(msg.recipients)
+
+
+@pytest.fixture
+def started(monkeypatch):
+    """Consumers started at init, instead of their threads."""
+    started = []
+    monkeypatch.setattr(
+        mail_queue_module,
+        'on_worker_start',
+        lambda func: started.append(func)
+    )
+    monkeypatch.setattr(
+        mail_queue_module,
+        'on_worker_exit',
+        lambda func: None
+    )
+    return started
+
+
+def make_queue(kind, mail, store=None):
+    """MailQueue of a new app, consumer threads are not started."""
+    app = Flask(__name__)
+    app.config.from_object(config)
+    app.config['MAIL_QUEUE'] = kind
+    app.config['MAIL_QUEUE_RETRIES'] = 3
+    app.config['MAIL_QUEUE_RETRY_DELAY'] = 10
+    app.extensions['mail'] = mail
+    mail_queue = MailQueue()
+    mail_queue.init_app(app, mail, store)
+    mail_queue.ensure_consumer = lambda: None
+    return mail_queue
+
+
+def message(mail_queue, recipient='user@example.com'):
+    """Email to recipient, built like in a view."""
+    with mail_queue.app.app_context():
+        return Message('Hello', recipients=[recipient], html='<p>Hello</p>')
+
+
+def test_shared_queue_starts_consumer_at_init(started):
+    """Every worker drains the shared queue, not only those that send."""
+    store = SharedStore(LocalSharedClient())
+    mail_queue = make_queue('shared', FakeMail(), store)
+
+    assert len(started) == 1
+    assert started[0].__self__ is mail_queue
+
+
+def test_local_queue_starts_consumer_when_used(started):
+    """A local queue is only drained by the process filling it."""
+    make_queue('local', FakeMail())
+
+    assert started == []
+
+
+def test_shared_queue_is_sent_by_other_worker(started):
+    """A job queued by one worker is sent by another one."""
+    store = SharedStore(LocalSharedClient())
+    sender = make_queue('shared', FakeMail(), store)
+    mail = FakeMail()
+    consumer = make_queue('shared', mail, store)
+
+    job_id = sender.send(message(sender))
+    assert sender.status(job_id) == 'queued'
+    assert consumer.depth() == 1
+
+    consumer.deliver(consumer.dequeue(timeout=1))
+    assert mail.sent == [['user@example.com']]
+    assert sender.status(job_id) == 'sent'
+
+
+def test_failed_send_is_retried_later(started, monkeypatch):
+    """A down SMTP server is not retried in a busy loop."""
+    now = [1000.0]
+    monkeypatch.setattr(mail_queue_module.time, 'time', lambda: now[0])
+    mail = FakeMail(failures=1)
+    mail_queue = make_queue('local', mail)
+    job_id = mail_queue.send(message(mail_queue))
+
+    mail_queue.deliver(mail_queue.dequeue(timeout=1))
+    job = mail_queue.dequeue(timeout=1)
+    assert job['attempts'] == 1
+    assert job['retry_at'] == 1010
+    assert mail_queue.status(job_id) == 'queued'
+
+    # Not due: put back and waited for, not sent
+    waits = []
+    mail_queue.stopped.wait = lambda timeout: (
+        waits.append(timeout), mail_queue.stopped.set()
+    )
+    mail_queue.enqueue(job)
+    mail_queue.run()
+    assert waits == [1]
+    assert mail.sent == []
+    assert mail_queue.depth() == 1
+
+    now[0] = 1010
+    mail_queue.stopped.clear()
+    mail_queue.deliver(mail_queue.dequeue(timeout=1))
+    assert mail.sent == [['user@example.com']]
+    assert mail_queue.status(job_id) == 'sent'
+
+
+def test_retry_delay_doubles_until_retries_are_exhausted(
+        started, monkeypatch):
+    """An email that can never be sent ends up failed."""
+    monkeypatch.setattr(mail_queue_module.time, 'time', lambda: 0)
+    mail_queue = make_queue('local', FakeMail(failures=10))
+    job_id = mail_queue.send(message(mail_queue))
+
+    delays = []
+    for _ in range(3):
+        mail_queue.deliver(mail_queue.dequeue(timeout=1))
+        job = mail_queue.dequeue(timeout=0)
+        if job is not None:
+            delays.append(job['retry_at'])
+            mail_queue.enqueue(job)
+
+    assert delays == [10, 20]
+    assert mail_queue.depth() == 0
+    assert mail_queue.status(job_id) == 'failed'
+
+
+def test_shared_job_keeps_retry_time(started):
+    """Retry time of a shared job goes through the store."""
+    store = SharedStore(LocalSharedClient())
+    mail_queue = make_queue('shared', FakeMail(failures=1), store)
+    mail_queue.send(message(mail_queue))
+
+    mail_queue.deliver(mail_queue.dequeue(timeout=1))
+    job = mail_queue.dequeue(timeout=1)
+    assert job['attempts'] == 1
+    assert job['retry_at'] > 0
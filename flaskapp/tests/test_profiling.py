@@ -0,0 +1,177 @@
+"""Sampling profiler and profile endpoints."""
+
+import threading
+import time
+
+import pytest
+
+import profiling
+from profiling import Sampler, profiler
+
+API_KEY = {'X-API-KEY': 'token'}
+
+
+def busy_work(stop):
+    """Spin until stop is set."""
+    while not stop.is_set():
+        sum(range(100))
+
+
+def sample(thread, ignore=False, thread_id=None):
+    """Sample while thread runs busy_work, return collapsed stacks."""
+    sampler = Sampler(0.001, thread_id)
+    if ignore:
+        sampler.ignore(thread)
+    sampler.start()
+    thread.start()
+    time.sleep(0.1)
+    thread.stop.set()
+    thread.join()
+    sampler.stop()
+    return sampler.folded()
+
+
+def busy_thread():
+    """Thread running busy_work until its stop event is set."""
+    stop = threading.Event()
+    thread = threading.Thread(target=busy_work, args=(stop,))
+    thread.stop = stop
+    return thread
+
+
+def test_samples_other_threads():
+    """Stacks of running threads are counted, not the sampler's own."""
+    stacks = sample(busy_thread())
+
+    assert 'test_profiling.py:busy_work' in stacks
+    assert 'profiling.py:run' not in stacks
+
+
+def test_ignores_thread_registered_before_start():
+    """A thread ignored before it starts is never sampled."""
+    stacks = sample(busy_thread(), ignore=True)
+
+    assert 'busy_work' not in stacks
+
+
+def test_samples_only_given_thread():
+    """A request profile only samples the thread of the request."""
+    stacks = sample(busy_thread(), thread_id=threading.get_ident())
+
+    assert 'busy_work' not in stacks
+
+
+@pytest.fixture
+def enabled(app, user, files, monkeypatch):
+    """Profiling enabled, the API user is an admin."""
+    user.is_admin = True
+    monkeypatch.setattr(profiler, 'enabled', True)
+    monkeypatch.setattr(profiler, 'config', app.config)
+    monkeypatch.setitem(app.config, 'PROFILING_INTERVAL', 0.001)
+    return profiler
+
+
+def wait_done(client, profile_id):
+    """GET profile until sampling is over."""
+    for _ in range(100):
+        response = client.get(
+            '/api/admin/profile/{}'.format(profile_id),
+            headers=API_KEY
+        )
+        if response.status_code != 202:
+            return response
+        assert 'Retry-After' in response.headers
+        time.sleep(0.05)
+    raise AssertionError("Profile never ended.")
+
+
+def test_profiles_worker(client, enabled, monkeypatch):
+    """POST starts sampling in background, GET returns it once done."""
+    samplers = []
+
+    class RecordingSampler(Sampler):
+        def start(self):
+            samplers.append(self)
+            self.ignored_at_start = set(self.ignored)
+            Sampler.start(self)
+    monkeypatch.setattr(profiling, 'Sampler', RecordingSampler)
+
+    response = client.post(
+        '/api/admin/profile',
+        json={'seconds': 0.2},
+        headers=API_KEY
+    )
+    assert response.status_code == 202
+    profile_id = response.get_json()['id']
+    running = client.get(
+        '/api/admin/profile/{}'.format(profile_id),
+        headers=API_KEY
+    )
+    assert running.status_code == 202
+    assert running.get_json()['status'] == 'running'
+
+    done = wait_done(client, profile_id)
+    assert done.status_code == 200
+    assert done.get_json()['status'] == 'done'
+    assert 'stacks' in done.get_json()
+    # Timer ending the profile was ignored before sampling began
+    timers = [
+        thread for thread in samplers[0].ignored_at_start
+        if isinstance(thread, threading.Timer)
+    ]
+    assert len(timers) == 1
+
+
+def test_one_worker_profile_at_a_time(client, enabled):
+    """A second profile of the same worker gets a 409."""
+    first = client.post(
+        '/api/admin/profile',
+        json={'seconds': 0.2},
+        headers=API_KEY
+    )
+    second = client.post(
+        '/api/admin/profile',
+        json={'seconds': 0.2},
+        headers=API_KEY
+    )
+
+    assert second.status_code == 409
+    wait_done(client, first.get_json()['id'])
+
+
+def test_rejects_bad_durations(client, enabled):
+    """seconds must be a positive number."""
+    for seconds in (0, -1, 'ten', True):
+        response = client.post(
+            '/api/admin/profile',
+            json={'seconds': seconds},
+            headers=API_KEY
+        )
+        assert response.status_code == 400
+
+
+def test_unknown_profile(client, enabled):
+    """Missing profiles are a 404, paths are not followed."""
+    for profile_id in ('worker-1-2-3', '..%2F..%2Fetc%2Fpasswd'):
+        response = client.get(
+            '/api/admin/profile/{}'.format(profile_id),
+            headers=API_KEY
+        )
+        assert response.status_code == 404
+
+
+def test_endpoints_need_admin(client, user, enabled):
+    """Profiles are for admins only."""
+    user.is_admin = False
+
+    response = client.post('/api/admin/profile', json={}, headers=API_KEY)
+    assert response.status_code == 403
+
+
+def test_disabled(client, user, monkeypatch):
+    """Nothing is profiled when PROFILING_ENABLED is off."""
+    user.is_admin = True
+    monkeypatch.setattr(profiler, 'enabled', False)
+
+    response = client.post('/api/admin/profile', json={}, headers=API_KEY)
+    assert response.status_code == 404
@@ -0,0 +1,68 @@
+"""SQL query budgets of the hot views, checked against a real database."""
+
+import io
+
+import pytest
+
+from datasets import datasets
+from query_budget import QueryBudgetExceeded
+from user_account.models import User
+
+
+def upload(client, token):
+    """Upload a file as a new version of the build dataset."""
+    return client.post(
+        '/api/build/1_upload',
+        data={'file': (io.BytesIO(b'a,b\n1,2\n'), 'data.csv')},
+        headers={'X-API-KEY': token}
+    )
+
+
+def login(client):
+    """Log in through the form."""
+    return client.post(
+        '/home/login',
+        data={'email': 'user@example.com', 'password': 'secret'}
+    )
+
+
+def test_upload_is_within_budget(client, database, files):
+    """Upload only loads the user of the token."""
+    response = upload(client, database)
+
+    assert response.status_code == 200
+    assert response.headers['X-Query-Count'] == '1'
+
+
+def test_upload_over_budget_fails(client, database, files, monkeypatch):
+    """A view running one query too many fails in tests."""
+    add = datasets.add
+
+    def add_and_query(user, name, stream):
+        User.query.filter_by(id=user.id).first()
+        return add(user, name, stream)
+    monkeypatch.setattr(datasets, 'add', add_and_query)
+
+    with pytest.raises(QueryBudgetExceeded, match='budget is 1'):
+        upload(client, database)
+
+
+def test_login_is_within_budget(client, database):
+    """Login looks the user up once."""
+    response = login(client)
+
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/home/')
+    assert response.headers['X-Query-Count'] == '1'
+
+
+def test_playground_is_within_budget(client, database):
+    """A logged in user is loaded once, then read from the user cache."""
+    login(client)
+
+    counts = []
+    for _ in range(2):
+        response = client.get('/home/')
+        assert response.status_code == 200
+        counts.append(response.headers['X-Query-Count'])
+    assert counts == ['1', '0']
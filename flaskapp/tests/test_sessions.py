@@ -0,0 +1,73 @@
+"""Server side sessions."""
+
+from flask import Flask, session
+import pytest
+
+from sessions import MemoryStore, ServerSideSessionInterface
+
+
+@pytest.fixture
+def store():
+    """Store of the sessions."""
+    return MemoryStore()
+
+
+@pytest.fixture
+def client(store):
+    """Client of an app logging users in and out like flask_login."""
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.session_interface = ServerSideSessionInterface(store)
+
+    @app.route('/visit')
+    def visit():
+        session['visits'] = session.get('visits', 0) + 1
+        return ''
+
+    @app.route('/login')
+    def login():
+        session['_user_id'] = '1'
+        return ''
+
+    @app.route('/logout')
+    def logout():
+        session.pop('_user_id')
+        return ''
+
+    return app.test_client()
+
+
+def session_id(client):
+    """Session id in the cookie of client."""
+    return next(c.value for c in client.cookie_jar if c.name == 'session')
+
+
+def test_keeps_id_between_requests(client):
+    """Session id is stable while the login state does not change."""
+    client.get('/visit')
+    sid = session_id(client)
+    client.get('/visit')
+    assert session_id(client) == sid
+
+
+def test_new_id_on_login(client, store):
+    """Id set before login is dropped, data is kept under a new id."""
+    client.get('/visit')
+    sid = session_id(client)
+    client.get('/login')
+    new_sid = session_id(client)
+
+    assert new_sid != sid
+    assert store.get('session:' + sid) is None
+    assert '"visits":1' in store.get('session:' + new_sid).replace(' ', '')
+
+
+def test_new_id_on_logout(client, store):
+    """Id of a logged in session is dropped on logout."""
+    client.get('/visit')
+    client.get('/login')
+    sid = session_id(client)
+    client.get('/logout')
+
+    assert session_id(client) != sid
+    assert store.get('session:' + sid) is None
@@ -0,0 +1,117 @@
+"""Backends of user files storage."""
+
+import io
+
+import pytest
+
+from storage import LocalBackend, MemoryBackend, UserStorage
+from user_account.models import User
+
+
+@pytest.fixture(params=['local', 'memory'])
+def storage(request, tmp_path):
+    """Storage on each backend that runs without a server."""
+    storage = UserStorage()
+    if request.param == 'local':
+        storage.backend = LocalBackend(str(tmp_path))
+    else:
+        storage.backend = MemoryBackend()
+    return storage
+
+
+@pytest.fixture
+def user():
+    """Owner of the files."""
+    return User(id=7, email='user@example.com')
+
+
+def read(storage, user, path, start=0):
+    """Content of a file of user."""
+    with storage.open(user, path, start) as f:
+        return f.read()
+
+
+def test_saves_and_opens_from_offset(storage, user):
+    """A file reads back whole or from a byte offset."""
+    storage.create_user_folders(user)
+    storage.save_stream(user, 'data/a.csv', io.BytesIO(b'0123456789'))
+
+    assert read(storage, user, 'data/a.csv') == b'0123456789'
+    assert read(storage, user, 'data/a.csv', 4) == b'456789'
+
+
+def test_missing_file_is_file_not_found(storage, user):
+    """Every backend raises the same error for a missing file."""
+    storage.create_user_folders(user)
+
+    with pytest.raises(FileNotFoundError):
+        storage.open(user, 'data/missing.csv')
+
+
+def test_renames_and_deletes(storage, user):
+    """A renamed file is only at its new path, delete is idempotent."""
+    storage.create_user_folders(user)
+    storage.save_stream(user, 'data/a.csv', io.BytesIO(b'a'))
+    storage.rename(user, 'data/a.csv', 'data/b.csv')
+
+    assert read(storage, user, 'data/b.csv') == b'a'
+    with pytest.raises(FileNotFoundError):
+        storage.open(user, 'data/a.csv')
+
+    storage.delete(user, 'data/b.csv')
+    storage.delete(user, 'data/b.csv')
+    with pytest.raises(FileNotFoundError):
+        storage.open(user, 'data/b.csv')
+
+
+def test_files_are_under_user_id(tmp_path, user):
+    """Local files are in a folder named after the user id."""
+    storage = UserStorage()
+    storage.backend = LocalBackend(str(tmp_path))
+    storage.create_user_folders(user)
+    storage.save_stream(user, 'model/m.bin', io.BytesIO(b'm'))
+
+    assert (tmp_path / '7' / 'model' / 'm.bin').read_bytes() == b'm'
+    assert storage.local_path(user, 'model/m.bin') == str(
+        tmp_path / '7' / 'model' / 'm.bin'
+    )
+
+
+def test_failed_save_keeps_previous_file(tmp_path, user):
+    """An upload cut midway does not leave a truncated file behind."""
+    class BrokenStream(object):
+        def read(self, size=-1):
+            raise IOError('connection reset')
+
+    storage = UserStorage()
+    storage.backend = LocalBackend(str(tmp_path))
+    storage.create_user_folders(user)
+    storage.save_stream(user, 'data/a.csv', io.BytesIO(b'old'))
+
+    with pytest.raises(IOError):
+        storage.save_stream(user, 'data/a.csv', BrokenStream())
+    assert read(storage, user, 'data/a.csv') == b'old'
+    assert sorted(p.name for p in (tmp_path / '7' / 'data').iterdir()) == [
+        'a.csv'
+    ]
+
+
+def test_moves_legacy_folder(storage, user):
+    """A folder named after the email moves under the user id, once."""
+    storage.backend.makedirs('user@example.com/data')
+    storage.backend.save('user@example.com/data/a.csv', io.BytesIO(b'a'))
+
+    assert storage.move_legacy_folder(user)
+    assert read(storage, user, 'data/a.csv') == b'a'
+    assert not storage.move_legacy_folder(user)
+
+
+def test_does_not_overwrite_id_folder(storage, user):
+    """Files already under the user id win over the legacy folder."""
+    storage.backend.makedirs('user@example.com/data')
+    storage.backend.save('user@example.com/data/a.csv', io.BytesIO(b'old'))
+    storage.create_user_folders(user)
+    storage.save_stream(user, 'data/a.csv', io.BytesIO(b'new'))
+
+    assert not storage.move_legacy_folder(user)
+    assert read(storage, user, 'data/a.csv') == b'new'
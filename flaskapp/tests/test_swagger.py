@@ -0,0 +1,59 @@
+"""Precomputed Swagger spec."""
+
+import gzip
+import json
+import os
+
+URL = '/api/swagger.json'
+
+
+def test_serves_spec_with_etag_per_encoding(client):
+    """Compressed and identity bodies are different representations."""
+    plain = client.get(URL)
+    compressed = client.get(URL, headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in plain.headers
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.data) == plain.data
+    assert 'paths' in json.loads(plain.data)
+    assert plain.headers['ETag'] != compressed.headers['ETag']
+    for response in (plain, compressed):
+        assert not response.headers['ETag'].startswith('W/')
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert 'max-age' in response.headers['Cache-Control']
+
+
+def test_not_modified_only_for_same_encoding(client):
+    """An ETag only validates the representation it was served with."""
+    plain = client.get(URL).headers['ETag']
+    compressed = client.get(
+        URL,
+        headers={'Accept-Encoding': 'gzip'}
+    ).headers['ETag']
+
+    def get(etag, **headers):
+        headers['If-None-Match'] = etag
+        return client.get(URL, headers=headers)
+
+    assert get(plain).status_code == 304
+    assert get(compressed, **{'Accept-Encoding': 'gzip'}).status_code == 304
+    # Weak comparison, as required for If-None-Match
+    assert get('W/' + plain).status_code == 304
+
+    response = get(plain, **{'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['ETag'] == compressed
+    assert get(compressed).status_code == 200
+
+
+def test_export(cli, tmp_path, monkeypatch):
+    """export-swagger writes the spec and its compressed variants."""
+    monkeypatch.chdir(tmp_path)
+    result = cli.invoke(args=['export-swagger'])
+
+    assert result.exit_code == 0
+    assert 'Swagger spec exported' in result.output
+    assert os.path.isfile(str(tmp_path / 'swagger.json'))
+    assert gzip.decompress(
+        (tmp_path / 'swagger.json.gz').read_bytes()
+    ) == (tmp_path / 'swagger.json').read_bytes()
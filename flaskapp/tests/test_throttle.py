@@ -0,0 +1,97 @@
+"""Throttling of the login form."""
+
+import pytest
+
+from sessions import MemoryStore
+from user_account.models import User
+from user_account.throttle import throttle
+
+
+@pytest.fixture
+def lookups(app, monkeypatch):
+    """Emails looked up in db, where no user exists."""
+    lookups = []
+
+    def get_by_email(email):
+        lookups.append(email)
+        return None
+
+    monkeypatch.setattr(throttle, 'store', MemoryStore())
+    monkeypatch.setattr(User, 'get_by_email', get_by_email)
+    return lookups
+
+
+def login(client, email, ip='10.0.0.1'):
+    """POST the login form, return status code."""
+    return client.post(
+        '/home/login',
+        data={'email': email, 'password': 'secret'},
+        environ_base={'REMOTE_ADDR': ip}
+    ).status_code
+
+
+def test_limits_ip(app, client, lookups, monkeypatch):
+    """An IP past THROTTLE_IP_LIMIT is rejected, others are not."""
+    monkeypatch.setitem(app.config, 'THROTTLE_IP_LIMIT', 3)
+    for i in range(3):
+        assert login(client, 'user{}@example.com'.format(i)) == 302
+
+    assert login(client, 'other@example.com') == 429
+    assert login(client, 'other@example.com', ip='10.0.0.2') == 302
+    assert throttle.rejections()['ip'] == 1
+
+
+def test_limits_email(app, client, lookups, monkeypatch):
+    """An email past THROTTLE_EMAIL_LIMIT is rejected from any IP."""
+    monkeypatch.setitem(app.config, 'THROTTLE_EMAIL_LIMIT', 3)
+    monkeypatch.setitem(app.config, 'THROTTLE_BACKOFF_BASE', 0)
+    for i in range(3):
+        ip = '10.0.1.{}'.format(i)
+        assert login(client, 'user@example.com', ip) == 302
+
+    assert login(client, 'USER@example.com', ip='10.0.2.1') == 429
+    assert throttle.rejections()['email'] == 1
+
+
+def test_backs_off_after_failure(client, lookups):
+    """A failed login blocks the email for a while."""
+    assert login(client, 'user@example.com') == 302
+
+    assert login(client, 'user@example.com', ip='10.0.0.2') == 429
+    assert throttle.rejections()['backoff'] == 1
+
+
+def test_unknown_email_skips_db(app, client, lookups, monkeypatch):
+    """An email that matched no user is not looked up again meanwhile."""
+    monkeypatch.setitem(app.config, 'THROTTLE_BACKOFF_BASE', 0)
+    for _ in range(3):
+        assert login(client, 'nobody@example.com') == 302
+
+    assert lookups == ['nobody@example.com']
+
+
+def test_backoff_does_not_block_password_reset(client, lookups):
+    """Bad logins cannot keep a user from resetting their password."""
+    assert login(client, 'user@example.com') == 302
+    assert login(client, 'user@example.com') == 429
+
+    response = client.post(
+        '/home/get-pwd-reset-email',
+        data={'email': 'user@example.com'},
+        environ_base={'REMOTE_ADDR': '10.0.0.1'}
+    )
+    assert response.status_code == 302
+
+
+def test_rejections_are_not_all_logged(app, client, lookups, monkeypatch,
+                                       caplog):
+    """A flood does not fill the log."""
+    monkeypatch.setattr(throttle, 'rejected', 0)
+    monkeypatch.setitem(app.config, 'THROTTLE_IP_LIMIT', 1)
+    for i in range(20):
+        login(client, 'user{}@example.com'.format(i))
+
+    assert throttle.rejections()['ip'] == 19
+    assert len([
+        r for r in caplog.records if 'Throttled' in r.getMessage()
+    ]) == 1
@@ -0,0 +1,52 @@
+"""Request tracing."""
+
+from flask import Flask
+import pytest
+
+import config
+from tracing import InMemoryExporter, Tracer
+
+SAMPLED = {'traceparent': '00-{}-{}-01'.format('a' * 32, 'b' * 16)}
+
+
+class FailingExporter(object):
+    """Exporter of a full disk."""
+
+    def export(self, spans):
+        """Fail."""
+        raise OSError("No space left on device")
+
+
+def make_app(exporter, **settings):
+    """App traced by a new tracer, sampling no request randomly."""
+    app = Flask(__name__)
+    app.config.from_object(config)
+    app.config.update(TRACING_ENABLED=True, TRACING_SAMPLE_RATE=0)
+    app.config.update(settings)
+    tracer = Tracer()
+    tracer.exporter = exporter
+    tracer.init_app(app)
+    app.route('/')(lambda: '')
+    return app, tracer
+
+
+@pytest.mark.parametrize('trusted', [False, True])
+def test_sampled_flag_only_trusted_if_configured(trusted):
+    """Clients cannot force tracing, unless traceparent is trusted."""
+    exporter = InMemoryExporter()
+    app, _ = make_app(exporter, TRACING_TRUST_TRACEPARENT=trusted)
+
+    app.test_client().get('/', headers=SAMPLED)
+
+    assert bool(exporter.spans) == trusted
+
+
+def test_export_errors_are_logged(caplog):
+    """A failing exporter is logged, without failing the request."""
+    app, tracer = make_app(FailingExporter(), TRACING_TRUST_TRACEPARENT=True)
+
+    for _ in range(3):
+        assert app.test_client().get('/', headers=SAMPLED).status_code == 200
+
+    assert tracer.export_errors == 3
+    assert len([r for r in caplog.records if r.name == app.name]) == 1
@@ -0,0 +1,124 @@
+"""API usage metering."""
+
+import os
+
+from flask import Flask, Response, g
+import pytest
+
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from apis import usage
+from apis.usage import UsageRecorder, init_usage_metering
+import config
+
+
+@pytest.fixture
+def app(tmp_path):
+    """App metering a plain and a streamed endpoint."""
+    app = Flask(__name__)
+    app.config.from_object(config)
+    app.config['USAGE_SPILL_PATH'] = str(tmp_path)
+    app.config['USAGE_SHUTDOWN_RETRIES'] = 1
+
+    @app.before_request
+    def authenticate():
+        g.usage_user_id = 1
+
+    @app.route('/plain')
+    def plain():
+        return 'x' * 100
+
+    @app.route('/streamed')
+    def streamed():
+        return Response(b'x' * 10 for _ in range(30))
+
+    return app
+
+
+@pytest.fixture
+def recorder(app, monkeypatch):
+    """Recorder of app, never flushed to a database."""
+    monkeypatch.setattr(UsageRecorder, 'ensure_flusher', lambda self: None)
+    return init_usage_metering(app)
+
+
+def bytes_out(recorder):
+    """Bytes out counted per endpoint."""
+    return {
+        endpoint: counter[2]
+        for (_, endpoint, _), counter in recorder.counters.items()
+    }
+
+
+def test_counts_plain_response(app, recorder):
+    """Bytes of a response are its length."""
+    app.test_client().get('/plain')
+
+    assert bytes_out(recorder) == {'plain': 100}
+
+
+def test_counts_streamed_response(app, recorder):
+    """Bytes of a streamed response are counted once sent."""
+    response = app.test_client().get('/streamed', buffered=True)
+
+    assert response.data == b'x' * 300
+    assert bytes_out(recorder) == {'streamed': 300}
+
+
+def test_spills_counters_when_shutdown_flush_fails(
+        app, recorder, monkeypatch):
+    """Counters of a failed last flush are flushed by another worker."""
+    app.test_client().get('/plain')
+    recorder.pid = os.getpid()
+    monkeypatch.setattr(UsageRecorder, 'flush', lambda self: 0)
+    recorder.shutdown()
+    assert recorder.counters == {}
+
+    other = UsageRecorder(app)
+    other.load_spilled()
+    assert bytes_out(other) == {'plain': 100}
+
+
+class FakeSession(object):
+    """Database session with nothing to roll back or close."""
+
+    def rollback(self):
+        """Nothing to roll back."""
+
+    def remove(self):
+        """Nothing to close."""
+
+
+def fake_write(written, rejected_user_ids, error=None):
+    """UsageRecorder.write rejecting some user ids, or raising error."""
+    def write(self, counters):
+        if error is not None:
+            raise error
+        if any(key[0] in rejected_user_ids for key in counters):
+            raise IntegrityError('INSERT', {}, Exception('foreign key'))
+        written.update(counters)
+    return write
+
+
+def test_drops_rows_that_cannot_be_written(app, recorder, monkeypatch):
+    """A deleted user does not block usage of the others."""
+    monkeypatch.setattr(usage.db, 'session', FakeSession())
+    written = {}
+    monkeypatch.setattr(UsageRecorder, 'write', fake_write(written, {2}))
+    for user_id in (1, 2, 3):
+        recorder.record(user_id, 'upload', 0, 10)
+
+    assert recorder.flush() == 2
+    assert sorted(key[0] for key in written) == [1, 3]
+    assert recorder.counters == {}
+
+
+def test_retries_when_database_is_down(app, recorder, monkeypatch):
+    """Counters are kept for next flush."""
+    monkeypatch.setattr(usage.db, 'session', FakeSession())
+    error = OperationalError('INSERT', {}, Exception('connection refused'))
+    monkeypatch.setattr(UsageRecorder, 'write', fake_write({}, (), error))
+    recorder.record(1, 'upload', 0, 10)
+
+    assert recorder.flush() == 0
+    assert bytes_out(recorder) == {'upload': 10}
@@ -0,0 +1,280 @@
+"""
+Request tracing.
+
+A sampled request gets a trace made of nested spans (auth, SQL queries,
+multipart parsing, file storage, mail...). Traces continue the W3C
+traceparent header passed by Nginx. Requests are sampled randomly, unless
+TRACING_TRUST_TRACEPARENT is set: the sampled flag of traceparent is then
+honoured, so it must come from a trusted proxy, not from clients.
+Finished spans go to a pluggable exporter.
+
+When tracing is disabled no hook is registered and tracer.span() returns
+a shared no-op context manager.
+"""
+
+import json
+import logging
+from logging.handlers import RotatingFileHandler
+import os
+import random
+import re
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+TRACEPARENT_RE = re.compile(
+    r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$'
+)
+
+
+class Span(object):
+    """Timed operation of a trace."""
+
+    def __init__(self, name, trace_id, parent_id, attributes):
+        """Start span now."""
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time()
+        self.end = None
+
+    def to_dict(self):
+        """Exportable representation of span."""
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'duration': self.end - self.start,
+            'attributes': self.attributes,
+        }
+
+
+class Trace(object):
+    """Spans of a request, with the stack of currently open ones."""
+
+    def __init__(self, trace_id, parent_id):
+        """parent_id is the span id found in traceparent, if any."""
+        self.trace_id = trace_id
+        self.parent_id = parent_id
+        self.stack = []
+        self.finished = []
+
+    def start(self, name, attributes):
+        """Open a span, child of the innermost open one."""
+        parent_id = self.stack[-1].span_id if self.stack else self.parent_id
+        span = Span(name, self.trace_id, parent_id, attributes)
+        self.stack.append(span)
+        return span
+
+    def finish(self, span):
+        """Close span."""
+        span.end = time.time()
+        if span in self.stack:
+            self.stack.remove(span)
+        self.finished.append(span)
+
+
+class SpanContext(object):
+    """Context manager opening and closing a span."""
+
+    def __init__(self, trace, name, attributes):
+        """Span is opened on enter."""
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.span = None
+
+    def __enter__(self):
+        """Open span."""
+        self.span = self.trace.start(self.name, self.attributes)
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, tb):
+        """Close span, recording the error if any."""
+        if exc_type is not None:
+            self.span.attributes['error'] = exc_type.__name__
+        self.trace.finish(self.span)
+        return False
+
+
+class NoopSpanContext(object):
+    """Context manager used when request is not traced."""
+
+    def __enter__(self):
+        """Nothing to open."""
+        return None
+
+    def __exit__(self, exc_type, exc_value, tb):
+        """Nothing to close."""
+        return False
+
+
+NOOP_SPAN = NoopSpanContext()
+
+
+class InMemoryExporter(object):
+    """Keep spans in a list, for tests."""
+
+    def __init__(self):
+        """Spans are appended to self.spans."""
+        self.spans = []
+
+    def export(self, spans):
+        """Keep spans."""
+        self.spans.extend(span.to_dict() for span in spans)
+
+
+class FileExporter(object):
+    """Append spans to a file as JSON lines, rotated like log files."""
+
+    def __init__(self, path, max_bytes, backup_count):
+        """Spans are appended to path, rotated past max_bytes."""
+        self.logger = logging.getLogger('tracing.{}'.format(path))
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        if not self.logger.handlers:
+            self.logger.addHandler(RotatingFileHandler(
+                path,
+                maxBytes=max_bytes,
+                backupCount=backup_count
+            ))
+
+    def export(self, spans):
+        """Write spans."""
+        self.logger.info(
+            '\n'.join(json.dumps(span.to_dict()) for span in spans)
+        )
+
+
+class Tracer(object):
+    """Create traces of sampled requests and export them."""
+
+    def __init__(self):
+        """Disabled until init_app."""
+        self.enabled = False
+        self.sample_rate = 0
+        self.trust_traceparent = False
+        self.exporter = None
+        self.logger = None
+        self.export_errors = 0
+
+    def init_app(self, app):
+        """Register request and SQLAlchemy hooks if tracing is enabled."""
+        self.enabled = app.config['TRACING_ENABLED']
+        if not self.enabled:
+            return
+        self.sample_rate = app.config['TRACING_SAMPLE_RATE']
+        self.trust_traceparent = app.config['TRACING_TRUST_TRACEPARENT']
+        self.logger = app.logger
+        if self.exporter is None:
+            if app.config['TRACING_EXPORTER'] == 'memory':
+                self.exporter = InMemoryExporter()
+            else:
+                self.exporter = FileExporter(
+                    app.config['TRACING_FILE_PATH'],
+                    app.config['TRACING_FILE_MAX_BYTES'],
+                    app.config['TRACING_FILE_BACKUP_COUNT']
+                )
+
+        app.before_request(self.start_trace)
+        app.after_request(self.add_trace_header)
+        app.teardown_request(self.end_trace)
+        event.listen(Engine, 'before_cursor_execute', self.start_query)
+        event.listen(Engine, 'after_cursor_execute', self.end_query)
+
+    def current_trace(self):
+        """Trace of current request, None if not traced."""
+        if not self.enabled or not has_request_context():
+            return None
+        return g.get('trace')
+
+    def span(self, name, **attributes):
+        """Context manager timing a block as a child span."""
+        trace = self.current_trace()
+        if trace is None:
+            return NOOP_SPAN
+        return SpanContext(trace, name, attributes)
+
+    def start_trace(self):
+        """
+        Continue trace from traceparent header, or start a new one.
+
+        Clients could force every request to be traced: the sampled flag
+        of traceparent is only honoured if TRACING_TRUST_TRACEPARENT.
+        """
+        match = TRACEPARENT_RE.match(request.headers.get('traceparent', ''))
+        if match:
+            trace_id, parent_id, flags = match.groups()
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+        if match and self.trust_traceparent:
+            sampled = int(flags, 16) & 1
+        else:
+            sampled = random.random() < self.sample_rate
+        if not sampled:
+            return
+        g.trace = Trace(trace_id, parent_id)
+        g.trace_root = g.trace.start('request', {
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+        })
+
+    def add_trace_header(self, response):
+        """Tell client which span served it."""
+        trace = g.get('trace')
+        if trace is not None:
+            response.headers['traceresponse'] = '00-{}-{}-01'.format(
+                trace.trace_id,
+                g.trace_root.span_id
+            )
+            g.trace_root.attributes['status'] = response.status_code
+        return response
+
+    def end_trace(self, exc):
+        """Close spans left open and export them."""
+        trace = g.get('trace')
+        if trace is None:
+            return
+        while trace.stack:
+            trace.finish(trace.stack[-1])
+        g.trace = None
+        # Tracing must never break a request, errors are only logged (the
+        # first one, then one every 1000)
+        try:
+            self.exporter.export(trace.finished)
+        except Exception:
+            if self.export_errors % 1000 == 0:
+                self.logger.exception(
+                    "Could not export trace ({} errors so far).".format(
+                        self.export_errors + 1
+                    )
+                )
+            self.export_errors += 1
+
+    def start_query(self, conn, cursor, statement, parameters, context,
+                    executemany):
+        """Open a span for a SQL query."""
+        trace = self.current_trace()
+        if trace is not None:
+            context._trace_span = trace.start(
+                'db.query',
+                {'statement': statement[:200]}
+            )
+
+    def end_query(self, conn, cursor, statement, parameters, context,
+                  executemany):
+        """Close the span of a SQL query."""
+        span = getattr(context, '_trace_span', None)
+        trace = self.current_trace()
+        if span is not None and trace is not None:
+            trace.finish(span)
+
+
+tracer = Tracer()
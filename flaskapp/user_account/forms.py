@@ -30,7 +30,7 @@ class RegistrationForm(Form):
         if not fv:
             return False
 
-        if User.query.get(self.email.data):
+        if User.get_by_email(self.email.data):
             self.email.errors.append('User already registered')
             return False
 
@@ -1,17 +1,60 @@
 """Database models of user_account."""
 
+from functools import lru_cache
+
 from flask_login import UserMixin
+from sqlalchemy.orm import make_transient_to_detached
 from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import (JSONWebSignatureSerializer
                           as Serializer, BadSignature)
 
-from setup import db, login_manager, app
+from setup import db, login_manager, app, user_cache
+
+
+# Functions called with a list of user ids whenever users are modified
+# outside of their own session (e.g. by admin bulk operations), so that
+# any cached auth state for them can be dropped.
+user_cache_invalidators = [user_cache.delete]
+
+
+def invalidate_user_cache(user_ids):
+    """Drop cached auth state of the given users."""
+    for invalidator in user_cache_invalidators:
+        invalidator(user_ids)
 
 
 @login_manager.user_loader
-def load_user(user_email):
-    """Make flask-login talk to database."""
-    return User.query.get(user_email)
+def load_user(user_id):
+    """
+    Make flask-login talk to database.
+
+    Sessions created before the switch to integer ids hold an email,
+    those users simply need to log in again.
+    """
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return None
+    data = user_cache.get(user_id)
+    if data is not None:
+        return User.from_cache(data)
+    user = User.query.get(user_id)
+    if user:
+        user_cache.set(user_id, user.to_cache())
+    return user
+
+
+@lru_cache(maxsize=4096)
+def sign_auth_token(secret_key, user_id, token_version):
+    """
+    Sign an API auth token.
+
+    Token only depends on the key, user id and token version, so it is
+    signed once. Rotating SECRET_KEY or bumping token_version misses the
+    cache.
+    """
+    s = Serializer(secret_key)
+    return s.dumps({'id': user_id, 'v': token_version})
 
 
 class User(UserMixin, db.Model):
@@ -24,7 +67,8 @@ class User(UserMixin, db.Model):
 
     __tablename__ = "flask_user"
 
-    email = db.Column(db.String(120), primary_key=True)
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), nullable=False)
     password = db.Column(db.String(256), nullable=False)
     first_name = db.Column(db.String(50), nullable=True)
     last_name = db.Column(db.String(50), nullable=True)
@@ -33,6 +77,12 @@ class User(UserMixin, db.Model):
     country = db.Column(db.String(50), nullable=True)
     address = db.Column(db.String(50), nullable=True)
     is_premium = db.Column(db.Boolean(), default=False, nullable=False)
+    is_admin = db.Column(
+        db.Boolean(),
+        default=False,
+        server_default=db.false(),
+        nullable=False
+    )
     registered_on = db.Column(
         db.DateTime,
         default=db.func.current_timestamp(),
@@ -45,6 +95,42 @@ class User(UserMixin, db.Model):
         nullable=True
     )
     confirmed = db.Column(db.Boolean(), nullable=False)
+    # Increment in order to revoke API tokens of user
+    token_version = db.Column(
+        db.Integer(),
+        default=0,
+        server_default='0',
+        nullable=False
+    )
+
+    # Support keyset pagination of admin listings filtered by status, and
+    # email prefix search. Email indexes use the "C" collation so that the
+    # same index serves ORDER BY and LIKE 'prefix%'.
+    # Emails are unique case insensitively. Partial indexes only hold the
+    # (few) premium and unconfirmed users.
+    __table_args__ = (
+        db.Index(
+            'ux_flask_user_email_lower',
+            db.func.lower(email),
+            unique=True
+        ),
+        db.Index(
+            'ix_flask_user_premium',
+            email.collate('C'),
+            postgresql_where=db.text('is_premium')
+        ),
+        db.Index(
+            'ix_flask_user_unconfirmed',
+            'registered_on',
+            postgresql_where=db.text('NOT confirmed')
+        ),
+        db.Index(
+            'ix_flask_user_confirmed_email',
+            confirmed,
+            email.collate('C')
+        ),
+        db.Index('ix_flask_user_email_c', email.collate('C')),
+    )
 
     def set_password(self, password):
         """Hash password before saving."""
@@ -58,27 +144,88 @@ class User(UserMixin, db.Model):
         """
         Override pk definition for flask-login.
 
-        By default flask-login expects an id as a pk but here we set email
-        as the pk, so need to override flask-login's get_id() method.
+        flask-login expects a unicode id.
         """
-        return self.email
+        return str(self.id)
+
+    def get_folder(self):
+        """
+        Get path of user folder.
+
+        Folder is named after the user id so that it does not have to move
+        if email changes.
+        """
+        return '{}/{}'.format(app.config['USER_FOLDERS_PATH'], self.id)
+
+    # Columns kept in user cache. Others are loaded from db on access.
+    CACHED_COLUMNS = (
+        'id',
+        'email',
+        'first_name',
+        'last_name',
+        'is_premium',
+        'is_admin',
+        'confirmed',
+        'token_version',
+    )
+
+    def to_cache(self):
+        """Get cached columns of user."""
+        return {c: getattr(self, c) for c in self.CACHED_COLUMNS}
+
+    @staticmethod
+    def from_cache(data):
+        """Rebuild a user attached to db session without querying db."""
+        user = User(**data)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
 
     def generate_auth_token(self):
         """Generate an API auth token for user."""
-        s = Serializer(app.config['SECRET_KEY'])
-        return s.dumps({'email': self.email})
+        return sign_auth_token(
+            app.config['SECRET_KEY'],
+            self.id,
+            self.token_version
+        )
+
+    def revoke_auth_token(self):
+        """
+        Revoke API token of user, a new one is generated.
+
+        Cached user is dropped so that pages do not show the old token.
+        """
+        self.token_version += 1
+        db.session.commit()
+        invalidate_user_cache([self.id])
 
     @staticmethod
     def verify_auth_token(token):
-        """Check that user API token is correct."""
+        """
+        Check that user API token is correct.
+
+        Tokens generated before the switch to integer ids hold an email
+        and remain valid.
+        """
         s = Serializer(app.config['SECRET_KEY'])
         try:
             data = s.loads(token)
         except BadSignature:
             return None  # invalid token
-        user = User.query.get(data['email'])
+        if 'id' in data:
+            user = User.query.get(data['id'])
+        else:
+            user = User.get_by_email(data['email'])
+        if user is None or data.get('v', 0) != user.token_version:
+            return None  # unknown user or revoked token
         return user
 
+    @staticmethod
+    def get_by_email(email):
+        """Find user by email, case insensitively."""
+        return User.query.filter(
+            db.func.lower(User.email) == email.lower()
+        ).first()
+
     def __repr__(self):
         """User object is represented by an email."""
         return '<{}>'.format(self.email)
@@ -0,0 +1,144 @@
+"""
+Throttling of login, registration and password reset forms.
+
+Abusive POSTs are rejected before any SQL query or password hashing:
+- sliding window limits per IP and per email
+- exponential backoff after failed logins on an email
+- negative cache of unknown emails, so repeated misses skip the db
+
+State lives in the session store if any (so it is shared by workers and
+nodes), or in memory otherwise. With the default cookie sessions, each
+uwsgi worker thus has its own limits and rejection counters: an IP gets up
+to THROTTLE_IP_LIMIT POSTs per worker, and admins see the counters of the
+worker serving them.
+"""
+
+import time
+
+from sessions import MemoryStore
+
+
+class Throttle(object):
+    """Rate limits and backoff of the user_account forms."""
+
+    def __init__(self):
+        """Store is set by init_app."""
+        self.store = MemoryStore()
+        self.shared = False
+        self.config = {}
+        self.logger = None
+        self.rejected = 0
+
+    def init_app(self, app, store=None):
+        """Use the session store if any, so that all workers share it."""
+        if store is not None:
+            self.store = store
+        self.config = app.config
+        self.logger = app.logger
+        self.shared = store is not None
+
+    def hit(self, scope, ident, limit):
+        """
+        Count a hit and tell if ident is over limit.
+
+        Sliding window approximated from the current and previous fixed
+        windows, weighted by how much of the previous one still overlaps.
+        """
+        window = self.config['THROTTLE_WINDOW']
+        now = time.time()
+        bucket = int(now // window)
+        key = 'throttle:{}:{}:{}'.format(scope, ident, bucket)
+        current = self.store.incr(key, 2 * window)
+        previous = int(self.store.get(
+            'throttle:{}:{}:{}'.format(scope, ident, bucket - 1)
+        ) or 0)
+        overlap = 1 - (now % window) / window
+        return current + previous * overlap > limit
+
+    def reject(self, reason):
+        """
+        Count and log a rejection.
+
+        A flood must not wipe the log: only the first rejection of the
+        worker is logged, then one every 1000.
+        """
+        self.store.incr('throttle:rejected:{}'.format(reason), 86400)
+        if self.rejected % 1000 == 0:
+            self.logger.warning(
+                "Throttled form POST: {} ({} rejections so far).".format(
+                    reason,
+                    self.rejected + 1
+                )
+            )
+        self.rejected += 1
+        return reason
+
+    def check(self, ip, email, login=False):
+        """
+        Check a form POST, before any db access.
+
+        Backoff after failed logins only applies to the login form, so that
+        bad logins cannot keep a user from resetting their password.
+        Return the reason of rejection, or None if request may go on.
+        """
+        email = (email or '').lower()
+        if self.hit('ip', ip, self.config['THROTTLE_IP_LIMIT']):
+            return self.reject('ip')
+        if email:
+            if login and self.store.get('throttle:block:{}'.format(email)):
+                return self.reject('backoff')
+            if self.hit('email', email, self.config['THROTTLE_EMAIL_LIMIT']):
+                return self.reject('email')
+        return None
+
+    def register_failure(self, email):
+        """Block email for an exponentially growing time after failures."""
+        email = email.lower()
+        failures = self.store.incr(
+            'throttle:failures:{}'.format(email),
+            self.config['THROTTLE_FAILURE_TTL']
+        )
+        delay = min(
+            self.config['THROTTLE_BACKOFF_BASE'] * 2 ** (failures - 1),
+            self.config['THROTTLE_BACKOFF_MAX']
+        )
+        self.store.set('throttle:block:{}'.format(email), 1, delay)
+
+    def reset_failures(self, email):
+        """Forget failures after a successful login."""
+        self.store.delete('throttle:failures:{}'.format(email.lower()))
+
+    def is_unknown(self, email):
+        """Tell if email recently matched no user."""
+        key = 'throttle:unknown:{}'.format(email.lower())
+        return self.store.get(key) is not None
+
+    def remember_unknown(self, email):
+        """Remember that email matched no user."""
+        self.store.set(
+            'throttle:unknown:{}'.format(email.lower()),
+            1,
+            self.config['THROTTLE_UNKNOWN_EMAIL_TTL']
+        )
+
+    def forget_unknown(self, email):
+        """Email now matches a user, e.g. after registration."""
+        self.store.delete('throttle:unknown:{}'.format(email.lower()))
+
+    def rejections(self):
+        """
+        Count of rejections by reason, counters are reset daily.
+
+        "shared" is false when counters only cover the current worker.
+        """
+        counts = {
+            reason: int(self.store.get(
+                'throttle:rejected:{}'.format(reason)
+            ) or 0)
+            for reason in ('ip', 'email', 'backoff')
+        }
+        counts['shared'] = self.shared
+        return counts
+
+
+throttle = Throttle()
@@ -19,10 +19,16 @@ from flask_login import (
     logout_user,
     current_user
 )
-import pathlib
-
-from setup import db, mail, app
-from .models import User
+import click
+import os
+
+from query_budget import query_budget
+from mail_queue import mail_queue
+from setup import db, app
+from storage import storage
+from tracing import tracer
+from .models import User, invalidate_user_cache
+from .throttle import throttle
 from .forms import (
     RegistrationForm,
     LoginForm,
@@ -40,6 +46,7 @@ user_account_pages = Blueprint(
 @user_account_pages.route('/', defaults={'page': 'index'})
 @user_account_pages.route('/<page>')
 @login_required
+@query_budget(1)
 def user_playground(page):
     """
     Show the user backoffice.
@@ -61,23 +68,35 @@ def user_playground(page):
     defaults={'page': 'login'}
 )
 @user_account_pages.route('/<page>')
+@query_budget(1)
 def login(page):
     """
     Log a user in.
 
     Checks if user exists in DB. If so, set a session for him.
+    Throttled requests and known unknown emails never reach the DB nor
+    the password hash check.
     """
     form = LoginForm(request.form)
+    if request.method == 'POST' and throttle.check(
+            request.remote_addr, form.email.data, login=True):
+        return too_many_attempts(page, form)
     if request.method == 'POST' and form.validate():
         email = form.email.data
         password = form.password.data
-        user = User.query.get(email)
+        user = None
+        if not throttle.is_unknown(email):
+            user = User.get_by_email(email)
+            if user is None:
+                throttle.remember_unknown(email)
         if user is None or not user.check_password(password):
             # If could not log in, stay on login page and raise an error
+            throttle.register_failure(email)
             flash('Invalid username or password')
             return redirect(url_for('user_account_pages.login'))
         # If user found in db, log him and redirect him to user_playground.
         # Remember user so no need to login again next time.
+        throttle.reset_failures(email)
         login_user(user, remember=True)
         app.logger.debug("{} logged in.".format(user))
         return redirect(url_for('user_account_pages.user_playground'))
@@ -87,6 +106,15 @@ def login(page):
         abort(404)
 
 
+def too_many_attempts(page, form):
+    """Render form again with a 429 error without touching the DB."""
+    flash('Too many attempts. Please try again later.')
+    try:
+        return render_template('%s.html' % page, form=form), 429
+    except TemplateNotFound:
+        abort(404)
+
+
 @user_account_pages.route('/logout', defaults={'page': 'logout'})
 def logout(page):
     """Log user out."""
@@ -122,7 +150,8 @@ def send_registration_email(user):
         recipients=[user.email],
         html=html
     )
-    mail.send(msg)
+    with tracer.span('mail.send', template='activate'):
+        mail_queue.send(msg)
     app.logger.debug("Activation email sent to {}.".format(user))
 
 
@@ -164,10 +193,11 @@ def get_registration_confirmation(page):
         return redirect(url_for('user_account_pages.activation_too_old'))
 
     # Try to find user in db and update it
-    user = User.query.get(email)
+    user = User.get_by_email(email)
     if user:
         user.confirmed = True
         db.session.commit()
+        invalidate_user_cache([user.id])
         app.logger.debug("User to be activated found in db: {}.".format(user))
         create_user_folders(user)
         app.logger.debug("User folders created for {}.".format(user))
@@ -187,24 +217,65 @@ def create_user_folders(user):
     """
     Create user folders.
 
-    Each user has one folder whose name is the email hash.
+    Each user has one folder whose name is the user id.
     This folder contains 2 subfolders:
     - data
     - model
-    Folder name is the user email in order to browse it easily.
+    Folders live in the storage backend (local folders, S3...).
+    """
+    storage.create_user_folders(user)
+
+
+@app.cli.command('move-user-folders')
+def move_user_folders():
     """
-    base_path = app.config['USER_FOLDERS_PATH']
-    folder_name = user.email
-    # Create data folder
-    pathlib.Path('{}/{}/data'.format(
-        base_path,
-        folder_name
-    )).mkdir(parents=True, exist_ok=True)
-    # Create model folder
-    pathlib.Path('{}/{}/model'.format(
-        base_path,
-        folder_name
-    )).mkdir(parents=True, exist_ok=True)
+    Rename user folders from email to user id.
+
+    Run once after the migration introducing user ids. Goes through the
+    storage backend, so it also moves S3 objects.
+    """
+    moved = 0
+    for user in User.query.yield_per(1000):
+        if storage.move_legacy_folder(user):
+            moved += 1
+    click.echo("{} user folders moved.".format(moved))
+
+
+@app.cli.command('create-user')
+@click.argument('email')
+@click.option('--password', help='Random if not given')
+@click.option('--premium', is_flag=True)
+@click.option('--admin', is_flag=True)
+def create_user(email, password, premium, admin):
+    """
+    Create a confirmed user, if missing, and print their API token.
+
+    Used to seed benchmarks, e.g. of docker-compose.multinode.yml.
+    """
+    user = User.get_by_email(email)
+    if user is None:
+        user = User(
+            email=email,
+            is_premium=premium,
+            is_admin=admin,
+            confirmed=True
+        )
+        user.set_password(password or os.urandom(16).hex())
+        db.session.add(user)
+        db.session.commit()
+        create_user_folders(user)
+    click.echo(user.generate_auth_token().decode('ascii'))
+
+
+@app.cli.command('revoke-token')
+@click.argument('email')
+def revoke_token(email):
+    """Revoke the API token of a user and print the new one."""
+    user = User.get_by_email(email)
+    if user is None:
+        raise click.ClickException("No user {}.".format(email))
+    user.revoke_auth_token()
+    click.echo(user.generate_auth_token().decode('ascii'))
 
 
 @user_account_pages.route(
@@ -267,6 +338,9 @@ def register(page):
     """
     form = RegistrationForm(request.form)
 
+    if request.method == 'POST' and throttle.check(
+            request.remote_addr, form.email.data):
+        return too_many_attempts(page, form)
     if request.method == 'POST' and form.validate():
         email = form.email.data
         password = form.password.data
@@ -275,9 +349,12 @@ def register(page):
             registered_on=datetime.now(),
             confirmed=False
         )
-        user.set_password(password)
-        db.session.add(user)
-        db.session.commit()
+        with tracer.span('auth.hash_password'):
+            user.set_password(password)
+        with tracer.span('db.commit'):
+            db.session.add(user)
+            db.session.commit()
+        throttle.forget_unknown(email)
         send_registration_email(user)
         app.logger.debug("{} successfully registered.".format(user))
         return redirect(url_for('user_account_pages.tmp_registration_ok'))
@@ -301,9 +378,16 @@ def get_pwd_reset_email(page):
     Once email is retrieved, send an encoded link to user.
     """
     form = SendResetEmailForm(request.form)
+    if request.method == 'POST' and throttle.check(
+            request.remote_addr, form.email.data):
+        return too_many_attempts(page, form)
     if request.method == 'POST' and form.validate():
         email = form.email.data
-        user = User.query.get(email)
+        user = None
+        if not throttle.is_unknown(email):
+            user = User.get_by_email(email)
+            if user is None:
+                throttle.remember_unknown(email)
         if user is None:
             # User not found for this email
             app.logger.debug("User not found for this email: {}".format(email))
@@ -346,7 +430,8 @@ def send_pwd_reset_email(email):
         recipients=[email],
         html=html
     )
-    mail.send(msg)
+    with tracer.span('mail.send', template='reset_pwd'):
+        mail_queue.send(msg)
     app.logger.debug("Pwd reset email sent to {}.".format(email))
 
 
@@ -389,7 +474,7 @@ def reset_pwd(page):
         return redirect(url_for('user_account_pages.activation_too_old'))
 
     # Try to find user in db and show form for new password
-    user = User.query.get(email)
+    user = User.get_by_email(email)
     if user:
         form = ResetPwdForm(request.form)
         if request.method == 'POST' and form.validate():